@@ -3,6 +3,9 @@ import json
 import os
 from datetime import datetime
 from pathlib import Path
+import codec
+from body_cache import body_text
+from data_io import append_jsonl, atomic_write_json, file_lock, iter_json_records, read_jsonl
 import google.generativeai as genai
 from dotenv import load_dotenv
 
@@ -14,27 +17,85 @@ MODEL_NAME = "models/gemini-2.5-flash"
 INBOX_PATH = Path("data/mock_inbox.json")
 PROMPT_PATH = Path("data/prompts.json")
 DRAFT_PATH = Path("data/drafts.json")
+# New drafts are appended here and folded into DRAFT_PATH every DRAFT_COMPACT_EVERY drafts.
+DRAFT_JOURNAL_PATH = Path("data/drafts.journal.jsonl")
+# The journal is moved here while it is being folded into DRAFT_PATH.
+DRAFT_PENDING_PATH = Path("data/drafts.journal.pending.jsonl")
+DRAFT_COMPACT_EVERY = 50
+
+def iter_inbox(path=INBOX_PATH):
+    """Yield inbox emails one at a time from a JSON array or JSON-lines file."""
+    if path.exists():
+        yield from iter_json_records(path)
 
 def load_inbox():
-    if INBOX_PATH.exists():
-        return json.loads(INBOX_PATH.read_text(encoding="utf-8"))
-    return []
+    return list(iter_inbox())
 
 def load_prompts():
     if PROMPT_PATH.exists():
-        return json.loads(PROMPT_PATH.read_text(encoding="utf-8"))
+        return codec.loads(PROMPT_PATH.read_bytes())
     return {}
 
-def load_drafts():
+def _load_draft_snapshot():
+    # Not validated here: compaction must carry every record over, valid or not.
     if DRAFT_PATH.exists():
-        return json.loads(DRAFT_PATH.read_text(encoding="utf-8"))
+        return codec.loads(DRAFT_PATH.read_bytes() or b"[]")
     return []
 
+def _valid_drafts(records):
+    """Records that match codec.Draft; any other is reported and skipped, not fatal."""
+    drafts = []
+    for record in records:
+        try:
+            drafts.append(codec.validate(record, codec.Draft))
+        except codec.VALIDATION_ERRORS as e:
+            print("Skipping invalid draft record:", e)
+    return drafts
+
+def _unfolded_pending(snapshot):
+    # A crash after the snapshot was rewritten but before the pending journal was
+    # removed leaves those drafts at the snapshot's tail already.
+    pending = read_jsonl(DRAFT_PENDING_PATH)
+    if pending and snapshot[-len(pending):] == pending:
+        return []
+    return pending
+
+def load_drafts():
+    """Drafts from the last snapshot plus any appended to the journal since."""
+    snapshot = _load_draft_snapshot()
+    return _valid_drafts(snapshot + _unfolded_pending(snapshot) + read_jsonl(DRAFT_JOURNAL_PATH))
+
+def _compact_drafts():
+    if DRAFT_JOURNAL_PATH.exists() and not DRAFT_PENDING_PATH.exists():
+        os.replace(DRAFT_JOURNAL_PATH, DRAFT_PENDING_PATH)
+    if DRAFT_PENDING_PATH.exists():
+        snapshot = _load_draft_snapshot()
+        pending = _unfolded_pending(snapshot)
+        if pending:
+            atomic_write_json(DRAFT_PATH, snapshot + pending)
+        DRAFT_PENDING_PATH.unlink()
+
 def save_prompts(prompts):
-    PROMPT_PATH.write_text(json.dumps(prompts, indent=2), encoding="utf-8")
+    with file_lock(PROMPT_PATH):
+        # Kept indented: prompts.json is meant to be read and edited by hand.
+        atomic_write_json(PROMPT_PATH, prompts, pretty=True)
 
 def save_drafts(drafts):
-    DRAFT_PATH.write_text(json.dumps(drafts, indent=2), encoding="utf-8")
+    """Replace all drafts: atomic snapshot write, then clear the journal."""
+    with file_lock(DRAFT_PATH):
+        atomic_write_json(DRAFT_PATH, drafts)
+        for path in (DRAFT_PENDING_PATH, DRAFT_JOURNAL_PATH):
+            if path.exists():
+                path.unlink()
+
+def append_draft(draft):
+    """Add one draft as an O(1) journal append; compacts into DRAFT_PATH periodically."""
+    with file_lock(DRAFT_PATH):
+        if DRAFT_PENDING_PATH.exists():
+            _compact_drafts()
+        append_jsonl(DRAFT_JOURNAL_PATH, [draft])
+        if len(read_jsonl(DRAFT_JOURNAL_PATH)) >= DRAFT_COMPACT_EVERY:
+            _compact_drafts()
 
 def call_gemini(system_prompt, user_prompt):
     model = genai.GenerativeModel(MODEL_NAME)
@@ -46,8 +107,7 @@ def process_email(email_dict, prompts):
     categorization_prompt = prompts.get("categorization_prompt", "")
     action_prompt = prompts.get("action_item_prompt", "")
 
-    body = email_dict.get("body", {})
-    content = body.get("text") if isinstance(body, dict) else str(body)
+    content = body_text(email_dict)
 
     cat_user_prompt = f"Email:\n{content}\n\nReturn category and reason in JSON."
     try:
@@ -71,14 +131,12 @@ def process_email(email_dict, prompts):
     }
 
 def summarize_email(email):
-    body = email.get("body", {})
-    content = body.get("text") if isinstance(body, dict) else str(body)
+    content = body_text(email)
     summary_prompt = "Summarize the email in 3-5 lines clearly."
     return call_gemini(summary_prompt, content)
 
 def draft_reply(email, prompts, tone="professional"):
-    body = email.get("body", {})
-    content = body.get("text") if isinstance(body, dict) else str(body)
+    content = body_text(email)
 
     auto_reply_prompt = prompts.get("auto_reply_prompt", "")
     user_prompt = f"Tone: {tone}\n\nOriginal Email:\n{content}"
@@ -86,6 +144,8 @@ def draft_reply(email, prompts, tone="professional"):
     try:
         raw = call_gemini(auto_reply_prompt, user_prompt)
         draft = json.loads(raw)
+        if not isinstance(draft, dict):
+            raise ValueError("Reply is not a JSON object")
     except Exception:
         draft = {
             "subject": "Re: " + (email.get("subject") or ""),
@@ -93,4 +153,12 @@ def draft_reply(email, prompts, tone="professional"):
             "suggested_followups": []
         }
 
-    return draft
+    # The model may answer null (or a non-string) for a field; drafts are saved
+    # with string fields, which load_drafts validates against codec.Draft.
+    followups = draft.get("suggested_followups")
+    return {
+        **draft,
+        "subject": str(draft.get("subject") or ""),
+        "body": str(draft.get("body") or ""),
+        "suggested_followups": followups if isinstance(followups, list) else [],
+    }
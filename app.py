@@ -1,31 +1,62 @@
 import os
+from itertools import islice
 from pathlib import Path
 import streamlit as st
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
 
 load_dotenv()
 
 from agent_logic import (
-    load_inbox,
+    iter_inbox,
     load_prompts,
     load_drafts,
     save_prompts,
-    save_drafts,
+    append_draft,
     process_email,
     draft_reply,
     summarize_email,
 )
-from gmail_client import gmail_authenticate
-from gmail_to_agent import fetch_and_process_gmail
+from gmail_client import gmail_service
+from gmail_to_agent import fetch_and_process_gmail, fetch_and_process_threads, load_full_body, load_attachment
+from gmail_ratelimit import STATS as GMAIL_RETRY_STATS
+from email_store import get_email_store
+from body_cache import get_body_cache, sanitize_html
 
 st.set_page_config(page_title="Prompt-Driven Email Agent", layout="wide")
 
+# Emails shown per page; further pages are read from `email_source` on "Load more".
+INBOX_PAGE_SIZE = 50
+
+
+def _show_first_page(source):
+    """Replace the inbox with the first page of an email iterator, keeping the rest lazy."""
+    page = list(islice(source, INBOX_PAGE_SIZE))
+    st.session_state.email_source = source if len(page) == INBOX_PAGE_SIZE else None
+    st.session_state.emails = page
+    return page
+
+
+def _load_next_page():
+    page = list(islice(st.session_state.get("email_source") or iter(()), INBOX_PAGE_SIZE))
+    if len(page) < INBOX_PAGE_SIZE:
+        st.session_state.email_source = None
+    st.session_state.emails = st.session_state.emails + page
+
+
+def _stored_emails(ids):
+    store = get_email_store()
+    for msg_id in ids:
+        email = store.get_message(msg_id)
+        if email is not None:
+            yield email
+
+
 if "emails" not in st.session_state:
     try:
-        st.session_state.emails = load_inbox()
+        _show_first_page(iter_inbox())
     except Exception:
         st.session_state.emails = []
+        st.session_state.email_source = None
 
 if "prompts" not in st.session_state:
     try:
@@ -50,22 +81,41 @@ emails = st.session_state.emails
 prompts = st.session_state.prompts
 drafts = st.session_state.drafts
 
+
+def _ensure_body(email):
+    with st.spinner("Loading message body..."):
+        try:
+            loaded = load_full_body(email)
+        except Exception as e:
+            st.error(f"Could not load message body: {e}")
+            return email
+    st.session_state.emails = [loaded if e.get("id") == loaded.get("id") else e for e in st.session_state.emails]
+    return loaded
+
 st.sidebar.title("Controls")
 
 if st.sidebar.button("Reload Mock Inbox"):
-    st.session_state.emails = load_inbox()
+    emails = _show_first_page(iter_inbox())
     st.sidebar.success("Mock inbox reloaded.")
-    emails = st.session_state.emails
 
 if st.sidebar.button("Process All Mock Emails"):
     with st.spinner("Processing mock inbox with prompts..."):
-        new_emails = []
-        for e in st.session_state.emails:
-            updated = process_email(e, st.session_state.prompts)
-            new_emails.append(updated)
-        st.session_state.emails = new_emails
-        emails = new_emails
-    st.sidebar.success("Processing complete!")
+        # Streams the inbox file and saves each batch to the email store, so only
+        # the current batch and the processed IDs are held in memory.
+        store = get_email_store()
+        version = store.save_prompt_version(st.session_state.prompts)
+        processed_ids = []
+        batch = []
+        for e in iter_inbox():
+            batch.append(process_email(e, st.session_state.prompts))
+            if len(batch) >= INBOX_PAGE_SIZE:
+                store.upsert_processed(batch, prompt_version=version)
+                processed_ids.extend(x.get("id") for x in batch)
+                batch = []
+        store.upsert_processed(batch, prompt_version=version)
+        processed_ids.extend(x.get("id") for x in batch)
+        emails = _show_first_page(_stored_emails(processed_ids))
+    st.sidebar.success(f"Processing complete! ({len(processed_ids)} emails)")
 
 st.sidebar.markdown("---")
 st.sidebar.title("Gmail Integration")
@@ -73,7 +123,9 @@ st.sidebar.title("Gmail Integration")
 if st.sidebar.button("Connect Gmail & Authenticate (OAuth)"):
     with st.spinner("Opening Google OAuth flow..."):
         try:
-            service = gmail_authenticate()
+            # Runs OAuth if needed and leaves a built service in the shared pool for the next fetch.
+            with gmail_service():
+                pass
             st.sidebar.success("Authenticated with Gmail! You can now fetch messages.")
         except Exception as e:
             st.sidebar.error(f"Auth failed: {e}")
@@ -91,8 +143,42 @@ process_mode = st.sidebar.selectbox(
 )
 st.sidebar.info(f"Current processing mode: **{process_mode}**")
 
+download_mode = st.sidebar.selectbox(
+    "Message download",
+    options=["Full messages", "Raw MIME (compact)", "Headers only (load bodies on open)"],
+    index=0,
+    help=(
+        "Raw MIME downloads one RFC 822 blob per message and parses it locally (smaller downloads and raw storage).\n"
+        "Headers only fetches subject/sender/snippet; the full body is downloaded when you open an email or it is processed."
+    ),
+)
+MESSAGE_FORMATS = {
+    "Full messages": "full",
+    "Raw MIME (compact)": "raw",
+    "Headers only (load bodies on open)": "metadata",
+}
+
+thread_mode = st.sidebar.checkbox(
+    "Process by thread",
+    value=False,
+    help="Fetch whole threads and run the prompts once per thread on its new messages; unchanged threads are skipped. 'Max messages' then limits threads.",
+)
+
 query = st.sidebar.text_input("Gmail query (e.g., is:unread -label:Processed)", value="is:inbox -label:Processed")
-max_msgs = st.sidebar.number_input("Max messages to fetch", min_value=1, max_value=200, value=50)
+incremental_sync = st.sidebar.checkbox(
+    "Incremental sync (only new mail since last fetch)",
+    value=False,
+    help=(
+        "Uses the Gmail history API after the first fetch; falls back to the query above when the history has expired. "
+        "Max messages is ignored here: every matching message is fetched, so none is skipped by the checkpoint."
+    ),
+)
+label_categories = st.sidebar.checkbox("Add category labels in Gmail (Agent/<category>)", value=False)
+fetch_workers = st.sidebar.number_input(
+    "Parallel fetch workers", min_value=1, max_value=32, value=1,
+    help="More than 1 fetches concurrently, paced by Gmail's per-user quota.",
+)
+max_msgs = st.sidebar.number_input("Max messages to fetch", min_value=1, max_value=100000, value=50)
 
 if st.sidebar.button("Fetch & Process Gmail"):
     if process_mode == "LLM (real)":
@@ -107,20 +193,61 @@ if st.sidebar.button("Fetch & Process Gmail"):
 
     with st.spinner(f"Fetching messages from Gmail and processing ({process_mode})..."):
         try:
-            processed = fetch_and_process_gmail(
-                max_messages=max_msgs,
-                query=query,
-                mark_processed=True,
-                skip_processing=skip_processing,
-                simulate_processing=simulate_processing,
-            )
+            if thread_mode:
+                processed = fetch_and_process_threads(
+                    max_threads=max_msgs,
+                    query=query,
+                    mark_processed=True,
+                    skip_processing=skip_processing,
+                    simulate_processing=simulate_processing,
+                    label_categories=label_categories,
+                )
+            else:
+                processed = fetch_and_process_gmail(
+                    max_messages=max_msgs,
+                    query=query,
+                    mark_processed=True,
+                    skip_processing=skip_processing,
+                    simulate_processing=simulate_processing,
+                    incremental=incremental_sync,
+                    label_categories=label_categories,
+                    message_format=MESSAGE_FORMATS[download_mode],
+                    workers=int(fetch_workers),
+                )
             processed_ids = {p.get("id") for p in processed}
             st.session_state.emails = processed + [e for e in st.session_state.emails if e.get("id") not in processed_ids]
             emails = st.session_state.emails
             st.sidebar.success(f"Fetched + processed {len(processed)} messages (mode: {process_mode}).")
+            stats = GMAIL_RETRY_STATS.snapshot()
+            st.sidebar.caption(
+                f"Gmail API retries: {stats['retries']} · rate-limited: {stats['throttled']} · gave up: {stats['failures']}"
+            )
         except Exception as e:
             st.sidebar.error(f"Fetch failed: {e}")
 
+st.sidebar.markdown("---")
+st.sidebar.title("Email Store")
+store_query = st.sidebar.text_input("Full-text search (subject, sender, body)", value="")
+store_raw_query = st.sidebar.checkbox("FTS5 query syntax (AND/OR/NEAR, prefix*, column:)", value=False)
+store_category = st.sidebar.selectbox("Category filter", ["All", "Important", "Newsletter", "Spam", "To-Do", "Unknown"])
+store_page_size = st.sidebar.number_input("Page size", min_value=10, max_value=500, value=50, step=10)
+store_page = st.sidebar.number_input("Page", min_value=1, value=1)
+if st.sidebar.button("Load from store"):
+    try:
+        store = get_email_store()
+        offset = (int(store_page) - 1) * int(store_page_size)
+        if store_query.strip():
+            page = store.search(store_query.strip(), limit=int(store_page_size), offset=offset, raw=store_raw_query)
+        else:
+            category = None if store_category == "All" else store_category
+            page = store.list_messages(limit=int(store_page_size), offset=offset, category=category)
+        st.session_state.emails = page
+        st.session_state.email_source = None
+        emails = page
+        st.sidebar.success(f"Loaded {len(page)} emails ({store.count_messages()} stored).")
+    except Exception as e:
+        st.sidebar.error(f"Store query failed: {e}")
+
 st.sidebar.markdown("---")
 st.sidebar.info("Prompts can be edited in the Prompt Brain tab. Drafts are saved locally and never sent automatically.")
 
@@ -146,9 +273,15 @@ with tab_inbox:
                 return f"{i} — {subj} — {sender} — [{cat}]"
 
             selected_id = st.radio("Select an email:", options=email_ids, format_func=format_fn)
+            if st.session_state.get("email_source") is not None:
+                if st.button(f"Load more (next {INBOX_PAGE_SIZE})"):
+                    _load_next_page()
+                    st.experimental_rerun()
 
         with right_col:
             selected_email = next((e for e in st.session_state.emails if e.get("id") == selected_id), None)
+            if selected_email and selected_email.get("body_loaded") is False:
+                selected_email = _ensure_body(selected_email)
             if not selected_email:
                 st.write("Email not found.")
             else:
@@ -159,27 +292,9 @@ with tab_inbox:
                 st.write(f"**Category:** `{selected_email.get('category', 'Not processed')}`")
 
                 st.markdown("**Body:**")
-                body_info = selected_email.get("body") or {}
-
-                if isinstance(body_info, dict):
-                    body_text = (body_info.get("text") or "") or ""
-                    body_html = body_info.get("html", None)
-                else:
-                    body_text = str(body_info or "")
-                    body_html = None
-
-                def clean_text(raw: str) -> str:
-                    if not raw:
-                        return ""
-                    soup = BeautifulSoup(raw, "html.parser")
-                    for tag in soup(["script", "style"]):
-                        tag.decompose()
-                    text = soup.get_text(separator="\n")
-                    lines = [ln.strip() for ln in text.splitlines()]
-                    cleaned = "\n\n".join([ln for ln in lines if ln])
-                    return cleaned
-
-                cleaned_text = clean_text(body_text)
+                # Parsed once per distinct body (see body_cache); reruns are lookups.
+                body_view = get_body_cache().for_email(selected_email)
+                body_html = body_view["html"]
 
                 show_html = st.checkbox("Render formatted HTML (sanitized)", value=False)
 
@@ -187,21 +302,39 @@ with tab_inbox:
                     import streamlit.components.v1 as components
                     wrapped_html = f"""
                     <div style='font-family: Arial, Helvetica, sans-serif; line-height: 1.5; padding: 12px;'>
-                        {body_html}
+                        {sanitize_html(body_html)}
                     </div>
                     """
                     components.html(wrapped_html, height=500, scrolling=True)
+                elif body_view["markdown"]:
+                    st.markdown(body_view["markdown"])
+                elif body_html:
+                    st.markdown("_(no readable text)_")
                 else:
-                    if cleaned_text.strip():
-                        md = cleaned_text.replace("\r\n", "\n")
-                        md = "\n\n".join([p.strip() for p in md.split("\n\n") if p.strip()])
-                        st.markdown(md)
-                    else:
-                        if body_html:
-                            fallback = clean_text(body_html)
-                            st.markdown(fallback if fallback else "_(no readable text)_")
-                        else:
-                            st.markdown("_(no message body)_")
+                    st.markdown("_(no message body)_")
+
+                attachments = selected_email.get("attachments") or []
+                if attachments:
+                    st.markdown("**Attachments:**")
+                    for idx, att in enumerate(attachments):
+                        label = f"{att.get('filename') or '(unnamed)'} ({att.get('mimeType')}, {att.get('size', 0)} bytes)"
+                        if not att.get("attachmentId"):
+                            st.write(f"- {label}")
+                            continue
+                        key = f"att_{selected_email.get('id')}_{idx}"
+                        if st.button(f"Fetch {label}", key=key):
+                            try:
+                                st.session_state[key + "_data"] = load_attachment(selected_email, att)
+                            except Exception as e:
+                                st.error(f"Attachment download failed: {e}")
+                        if st.session_state.get(key + "_data"):
+                            st.download_button(
+                                f"Save {att.get('filename') or 'attachment'}",
+                                data=st.session_state[key + "_data"],
+                                file_name=att.get("filename") or "attachment",
+                                mime=att.get("mimeType") or "application/octet-stream",
+                                key=key + "_save",
+                            )
 
                 st.markdown("**Category Reason:**")
                 reason = selected_email.get("category_reason", "")
@@ -232,6 +365,11 @@ with tab_inbox:
                 if st.button("Re-run processing for this email"):
                     with st.spinner("Running prompts on selected email..."):
                         updated = process_email(selected_email, st.session_state.prompts)
+                        try:
+                            store = get_email_store()
+                            store.upsert_processed([updated], prompt_version=store.save_prompt_version(st.session_state.prompts))
+                        except Exception:
+                            pass
                         st.session_state.emails = [updated if e.get("id") == updated.get("id") else e for e in st.session_state.emails]
                         st.experimental_rerun()
 
@@ -250,6 +388,7 @@ with tab_prompt:
         }
         try:
             save_prompts(new_prompts)
+            get_email_store().save_prompt_version(new_prompts)
             st.session_state.prompts = new_prompts
             st.success("Prompts saved to disk and session.")
         except Exception as e:
@@ -270,6 +409,8 @@ with tab_agent:
             format_func=lambda i: f"{i}: {next((x for x in st.session_state.emails if x.get('id') == i), {}).get('subject','')}"
         )
         agent_email = next((e for e in st.session_state.emails if e.get("id") == agent_email_id), None)
+        if agent_email and agent_email.get("body_loaded") is False:
+            agent_email = _ensure_body(agent_email)
         if agent_email:
             st.markdown(f"**Selected:** {agent_email.get('subject')}")
             st.markdown("### Quick Actions")
@@ -321,7 +462,8 @@ with tab_agent:
                                 "suggested_followups": reply.get("suggested_followups", []),
                             }
                             st.session_state.drafts.append(draft_record)
-                            save_drafts(st.session_state.drafts)
+                            append_draft(draft_record)
+                            get_email_store().add_draft(draft_record)
                             st.success("Draft saved locally (not sent).")
                         except Exception as e:
                             st.error(f"Drafting failed: {e}")
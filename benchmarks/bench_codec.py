@@ -0,0 +1,69 @@
+# benchmarks/bench_codec.py
+#
+# Compare JSON backends on the raw fetch dump:
+#   python -m benchmarks.bench_codec [--path data/gmail_raw.json] [--repeat 5]
+import argparse
+import json
+import time
+from pathlib import Path
+
+import codec
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON backends on the raw fetch dump.")
+    parser.add_argument("--path", type=Path, default=Path("data") / "gmail_raw.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    raw = args.path.read_bytes()
+    obj = json.loads(raw)
+    print(f"{args.path}: {len(raw) / 1e6:.1f} MB, {len(obj)} records, backends: {', '.join(codec.BACKENDS)}")
+    print(f"{'case':<32}{'loads s':>10}{'dumps s':>10}{'out MB':>10}")
+
+    # What the code did before the codec layer: stdlib json with indent=2.
+    baseline_out = json.dumps(obj, indent=2).encode("utf-8")
+    print(
+        f"{'json indent=2 (previous)':<32}"
+        f"{best_of(lambda: json.loads(raw), args.repeat):>10.3f}"
+        f"{best_of(lambda: json.dumps(obj, indent=2).encode('utf-8'), args.repeat):>10.3f}"
+        f"{len(baseline_out) / 1e6:>10.1f}"
+    )
+    for backend in codec.BACKENDS:
+        out = codec.dumps(obj, backend=backend)
+        assert codec.loads(out, backend=backend) == obj
+        print(
+            f"{backend + ' compact':<32}"
+            f"{best_of(lambda: codec.loads(raw, backend=backend), args.repeat):>10.3f}"
+            f"{best_of(lambda: codec.dumps(obj, backend=backend), args.repeat):>10.3f}"
+            f"{len(out) / 1e6:>10.1f}"
+        )
+
+    # Raw store pattern: one record per line, encoded on append and decoded on get().
+    print(f"{'per record (raw store lines)':<32}")
+    print(
+        f"{'  json (previous)':<32}"
+        f"{best_of(lambda: [json.loads(json.dumps(r)) for r in obj], args.repeat):>10.3f}  (dumps+loads)"
+    )
+    for backend in codec.BACKENDS:
+        print(
+            f"{'  ' + backend:<32}"
+            f"{best_of(lambda: [codec.loads(codec.dumps(r, backend=backend), backend=backend) for r in obj], args.repeat):>10.3f}"
+            "  (dumps+loads)"
+        )
+    if codec.msgspec is not None:
+        typed = best_of(lambda: codec.decode(raw, type=codec.Messages), args.repeat)
+        print(f"{'msgspec typed (Messages)':<32}{typed:>10.3f}{'':>10}{'':>10}")
+
+
+if __name__ == "__main__":
+    main()
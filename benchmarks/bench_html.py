@@ -0,0 +1,71 @@
+# benchmarks/bench_html.py
+#
+# HTML-to-text throughput over the HTML parts of the stored corpus, for every
+# installed html_text backend against the BeautifulSoup extraction it replaced:
+#   python -m benchmarks.bench_html [--path data/gmail_raw.json] [--repeat 5]
+import argparse
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+import codec
+from gmail_client import _walk_parts
+from html_text import BACKENDS, html_to_text
+
+
+def legacy_html_to_text(html: str) -> str:
+    """The BeautifulSoup extraction gmail_client used before html_text (kept for comparison)."""
+    if not html:
+        return ""
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style"]):
+        tag.decompose()
+    text = soup.get_text(separator="\n")
+    lines = [line.strip() for line in text.splitlines()]
+    return "\n".join([ln for ln in lines if ln])
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def corpus_html(records):
+    for r in records:
+        payload = (r.get("raw_gmail") or {}).get("payload")
+        if payload:
+            yield from _walk_parts(payload)[1]
+        elif isinstance(r.get("body"), str) and "<" in r["body"]:
+            yield r["body"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML-to-text backends on stored messages.")
+    parser.add_argument("--path", type=Path, default=Path("data") / "gmail_raw.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    docs = list(corpus_html(codec.loads(args.path.read_bytes())))
+    size_mb = sum(len(d.encode("utf-8")) for d in docs) / 1e6
+    print(f"{len(docs)} HTML parts ({size_mb:.1f} MB) from {args.path}")
+
+    expected = [legacy_html_to_text(d) for d in docs]
+    baseline = best_of(lambda: [legacy_html_to_text(d) for d in docs], args.repeat)
+    print(f"{'beautifulsoup (previous)':26}{baseline * 1000:9.1f} ms {size_mb / baseline:7.1f} MB/s")
+
+    for name in BACKENDS:
+        same = sum(html_to_text(d, backend=name) == e for d, e in zip(docs, expected))
+        elapsed = best_of(lambda: [html_to_text(d, backend=name) for d in docs], args.repeat)
+        print(
+            f"{name:26}{elapsed * 1000:9.1f} ms {size_mb / elapsed:7.1f} MB/s"
+            f"  ({baseline / elapsed:.2f}x, identical output {same}/{len(docs)})"
+        )
+
+
+if __name__ == "__main__":
+    main()
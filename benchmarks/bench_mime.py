@@ -0,0 +1,93 @@
+# benchmarks/bench_mime.py
+#
+# Time the payload part walk over the stored corpus, old recursive extractor vs the
+# iterative one in gmail_client:
+#   python -m benchmarks.bench_mime [--path data/gmail_raw.json] [--repeat 5]
+import argparse
+import base64
+import time
+from pathlib import Path
+
+import codec
+from gmail_client import _attachment_info, _is_attachment_part, _walk_parts
+
+
+def legacy_extract_parts(part):
+    """The recursive extractor gmail_client used before _walk_parts (kept for comparison)."""
+    plain_parts = []
+    html_parts = []
+    attachments = []
+
+    if _is_attachment_part(part):
+        attachments.append(_attachment_info(part))
+        return plain_parts, html_parts, attachments
+
+    mimeType = part.get("mimeType", "")
+    body = part.get("body", {}) or {}
+
+    if mimeType == "text/plain" and body.get("data"):
+        try:
+            data = base64.urlsafe_b64decode(body["data"].encode("ASCII")).decode("utf-8", errors="replace")
+            plain_parts.append(data)
+        except Exception:
+            pass
+    elif mimeType == "text/html" and body.get("data"):
+        try:
+            data = base64.urlsafe_b64decode(body["data"].encode("ASCII")).decode("utf-8", errors="replace")
+            html_parts.append(data)
+        except Exception:
+            pass
+
+    for sub in part.get("parts", []) or []:
+        p, h, a = legacy_extract_parts(sub)
+        plain_parts.extend(p)
+        html_parts.extend(h)
+        attachments.extend(a)
+
+    return plain_parts, html_parts, attachments
+
+
+def legacy_walk(payload):
+    # The old entry point decoded a top-level body separately, then walked the tree.
+    if payload.get("body", {}).get("data") and not _is_attachment_part(payload):
+        try:
+            raw = base64.urlsafe_b64decode(payload["body"]["data"].encode("ASCII")).decode("utf-8", errors="replace")
+            return [raw], [], []
+        except Exception:
+            pass
+    return legacy_extract_parts(payload)
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MIME part walk on stored messages.")
+    parser.add_argument("--path", type=Path, default=Path("data") / "gmail_raw.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    records = codec.loads(args.path.read_bytes())
+    payloads = [r["raw_gmail"]["payload"] for r in records if (r.get("raw_gmail") or {}).get("payload")]
+
+    for payload in payloads:
+        old, new = legacy_walk(payload), _walk_parts(payload)
+        # Single-part text/html messages used to come back as "plain"; compare contents.
+        assert old[0] + old[1] == new[0] + new[1] or old[0] + old[1] == new[1] + new[0]
+        assert old[2] == new[2]
+
+    legacy = best_of(lambda: [legacy_walk(p) for p in payloads], args.repeat)
+    iterative = best_of(lambda: [_walk_parts(p) for p in payloads], args.repeat)
+    print(f"{len(payloads)} payloads from {args.path}")
+    print(f"recursive (previous): {legacy * 1000:8.1f} ms")
+    print(f"iterative:            {iterative * 1000:8.1f} ms  ({legacy / iterative:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
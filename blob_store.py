@@ -0,0 +1,209 @@
+# blob_store.py
+import base64
+import gzip
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from data_io import atomic_write_bytes
+
+try:
+    import zstandard
+except ImportError:  # gzip is used when zstandard is not installed
+    zstandard = None
+
+BLOB_DIR = Path("data") / "blobs"
+
+# Strings shorter than this stay inline in the record; a blob ref is ~90 bytes.
+BLOB_MIN_BYTES = 512
+
+ZSTD_LEVEL = 10
+GZIP_LEVEL = 6
+
+# A blob reference replaces a string field in a stored record. "enc": "b64u" marks
+# Gmail base64url data that was decoded before storing (so it compresses and
+# de-duplicates against the same content in `body`).
+BLOB_KEY = "$blob"
+
+
+class BlobStore:
+    """
+    Content-addressed store for message payloads.
+
+    Each blob is named by the sha256 of its uncompressed bytes and stored once under
+    <root>/<first two hex chars>/<hash>.zst (zstandard installed) or .gz (otherwise).
+    Putting content that is already present costs one stat() and no write.
+    """
+
+    def __init__(self, root: Path = BLOB_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.suffix = ".zst" if zstandard is not None else ".gz"
+
+    def _path(self, key: str, suffix: str) -> Path:
+        return self.root / key[:2] / (key + suffix)
+
+    def _find(self, key: str) -> Optional[Path]:
+        for suffix in (".zst", ".gz"):
+            path = self._path(key, suffix)
+            if path.exists():
+                return path
+        return None
+
+    def __contains__(self, key: str) -> bool:
+        return self._find(key) is not None
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        if self._find(key) is not None:
+            return key
+        if zstandard is not None:
+            packed = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+        else:
+            packed = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+        atomic_write_bytes(self._path(key, self.suffix), packed)
+        return key
+
+    def get(self, key: str) -> bytes:
+        path = self._find(key)
+        if path is None:
+            raise KeyError(key)
+        packed = path.read_bytes()
+        if path.suffix == ".zst":
+            if zstandard is None:
+                raise RuntimeError(f"Blob {key} is zstd-compressed but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(packed)
+        return gzip.decompress(packed)
+
+    def _blob_paths(self):
+        return (p for p in self.root.glob("*/*") if p.suffix in (".zst", ".gz"))
+
+    def disk_usage(self) -> int:
+        return sum(p.stat().st_size for p in self._blob_paths())
+
+    def sweep(self, live: Set[str]) -> int:
+        """
+        Delete every blob whose key is not in `live`; returns the bytes freed.
+
+        The caller must hold off writers that could reference a blob which already
+        exists (put() does not rewrite it), e.g. RawStore.compact() under its lock.
+        """
+        freed = 0
+        for path in list(self._blob_paths()):
+            if path.name.split(".", 1)[0] in live:
+                continue
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            freed += size
+        return freed
+
+
+def _is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and BLOB_KEY in value
+
+
+def _b64u_decode(data: str) -> Optional[bytes]:
+    """Decoded bytes if `data` round-trips exactly through base64url, else None."""
+    try:
+        raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    except (ValueError, TypeError):
+        return None
+    return raw if base64.urlsafe_b64encode(raw).decode("ascii") == data else None
+
+
+def _put_text(blobs: BlobStore, value: Any, min_size: int) -> Any:
+    if isinstance(value, str) and len(value) >= min_size:
+        return {BLOB_KEY: blobs.put(value.encode("utf-8"))}
+    return value
+
+
+def _put_b64(blobs: BlobStore, value: Any, min_size: int) -> Any:
+    if not isinstance(value, str) or len(value) < min_size:
+        return value
+    raw = _b64u_decode(value)
+    if raw is None:
+        return {BLOB_KEY: blobs.put(value.encode("utf-8"))}
+    return {BLOB_KEY: blobs.put(raw), "enc": "b64u"}
+
+
+def _get_value(blobs: BlobStore, value: Any) -> Any:
+    if not _is_ref(value):
+        return value
+    data = blobs.get(value[BLOB_KEY])
+    if value.get("enc") == "b64u":
+        return base64.urlsafe_b64encode(data).decode("ascii")
+    return data.decode("utf-8")
+
+
+def _map_payload(part: Dict[str, Any], fn) -> Dict[str, Any]:
+    """Copy of a Gmail payload tree with fn applied to every part's body.data."""
+    part = dict(part)
+    body = part.get("body")
+    if isinstance(body, dict) and "data" in body:
+        part["body"] = {**body, "data": fn(body["data"])}
+    if part.get("parts"):
+        part["parts"] = [_map_payload(p, fn) for p in part["parts"]]
+    return part
+
+
+def _map_record(record: Dict[str, Any], text_fn, b64_fn) -> Dict[str, Any]:
+    record = dict(record)
+    body = record.get("body")
+    if isinstance(body, dict) and not _is_ref(body):
+        record["body"] = {k: text_fn(v) for k, v in body.items()}
+    elif "body" in record:
+        record["body"] = text_fn(body)
+    raw_gmail = record.get("raw_gmail")
+    if isinstance(raw_gmail, dict):
+        raw_gmail = dict(raw_gmail)
+        if isinstance(raw_gmail.get("payload"), dict):
+            raw_gmail["payload"] = _map_payload(raw_gmail["payload"], b64_fn)
+        if "raw" in raw_gmail:
+            raw_gmail["raw"] = b64_fn(raw_gmail["raw"])
+        record["raw_gmail"] = raw_gmail
+    return record
+
+
+def blob_refs(record: Dict[str, Any]) -> Set[str]:
+    """Keys of the blobs an externalized record references."""
+    refs: Set[str] = set()
+
+    def mark(value):
+        if _is_ref(value):
+            refs.add(value[BLOB_KEY])
+        return value
+
+    if "body" in record or "raw_gmail" in record:
+        _map_record(record, mark, mark)
+    return refs
+
+
+def externalize(record: Dict[str, Any], blobs: BlobStore, min_size: int = BLOB_MIN_BYTES) -> Dict[str, Any]:
+    """
+    Copy of a raw message record with its large payload strings moved into `blobs`.
+
+    Covers `body` (string or {"text", "html"}), every raw_gmail payload part's
+    body.data and raw_gmail["raw"]. The base64url fields are stored decoded, so an
+    HTML part and an identical `body` string share one blob.
+    """
+    if "body" not in record and "raw_gmail" not in record:
+        return record
+    return _map_record(
+        record,
+        lambda v: _put_text(blobs, v, min_size),
+        lambda v: _put_b64(blobs, v, min_size),
+    )
+
+
+def rehydrate(record: Dict[str, Any], blobs: BlobStore) -> Dict[str, Any]:
+    """Inverse of externalize: resolve every blob reference back to its original string."""
+    if "body" not in record and "raw_gmail" not in record:
+        return record
+
+    def resolve(value):
+        return _get_value(blobs, value)
+
+    return _map_record(record, resolve, resolve)
@@ -0,0 +1,231 @@
+# body_cache.py
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from bleach.sanitizer import Cleaner
+
+import codec
+from email_store import get_email_store
+from html_text import html_to_text
+
+BODY_VIEW_DIR = Path("data") / "body_views"
+# Views kept in memory; the rest are re-read from BODY_VIEW_DIR on demand.
+MEMORY_ENTRIES = 512
+
+# Tags/attributes kept by sanitize_html; everything else is stripped.
+ALLOWED_TAGS = [
+    "a", "b", "i", "strong", "em", "p", "br", "ul", "ol", "li", "blockquote", "code", "pre",
+    "h1", "h2", "h3", "h4", "table", "thead", "tbody", "tr", "td", "th", "img"
+]
+ALLOWED_ATTRIBUTES = {
+    "a": ["href", "title", "rel", "target"],
+    "img": ["src", "alt", "title", "width", "height"],
+    "*": ["style"]
+}
+
+# Total size (characters) of sanitized HTML kept in memory; least recently rendered go first.
+SANITIZED_MAX_CHARS = 32 * 1024 * 1024
+
+# Legacy records (gmail_raw.json, some inbox exports) store the raw HTML as a plain
+# string body; this tells it apart from a plain-text body.
+_HTML_RE = re.compile(r"<\s*(!doctype|html|head|body|div|p|br|table|span|a)\b", re.IGNORECASE)
+
+
+def body_hash(body: Any) -> str:
+    data = body.encode("utf-8") if isinstance(body, str) else codec.dumps(body)
+    return hashlib.sha256(data).hexdigest()
+
+
+def _paragraphs(text: str) -> str:
+    lines = [line.strip() for line in text.replace("\r\n", "\n").splitlines()]
+    return "\n\n".join(line for line in lines if line)
+
+
+def normalize_body(body: Any) -> Dict[str, Optional[str]]:
+    """
+    One parse of a message body into the forms the app and the LLM use:
+      text     – plain text (the text/plain part, else text extracted from the HTML)
+      markdown – the text as one paragraph per line, for st.markdown
+      html     – the message HTML as received, or None when it has none; pass it
+                 through sanitize_html() before rendering
+    `body` is either {"text", "html"} (Gmail fetches) or a string holding plain
+    text or raw HTML.
+    """
+    if isinstance(body, dict):
+        text = body.get("text") or ""
+        html = body.get("html") or None
+    else:
+        raw = str(body or "")
+        if _HTML_RE.search(raw):
+            text, html = "", raw
+        else:
+            text, html = raw, None
+
+    # Plain-text parts sometimes carry markup too, so both go through the HTML-to-text pass.
+    readable = html_to_text(text) if text else ""
+    if not readable and html:
+        readable = html_to_text(html)
+    return {"text": text or readable, "markdown": _paragraphs(readable), "html": html}
+
+
+class BodyViewCache:
+    """
+    Normalized body views keyed by the sha256 of the body.
+
+    Lookups go memory (LRU of `max_entries`) -> <root>/<ab>/<hash>.json -> normalize_body,
+    and computed views are written back, so each distinct body is parsed once across
+    reruns and restarts.
+    """
+
+    def __init__(self, root: Path = BODY_VIEW_DIR, max_entries: int = MEMORY_ENTRIES):
+        self.root = Path(root)
+        self.max_entries = max_entries
+        self._views: "OrderedDict[str, Dict[str, Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def _remember(self, key: str, view: Dict[str, Optional[str]]):
+        with self._lock:
+            self._views[key] = view
+            self._views.move_to_end(key)
+            while len(self._views) > self.max_entries:
+                self._views.popitem(last=False)
+
+    def _read(self, key: str) -> Optional[Dict[str, Optional[str]]]:
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            return codec.loads(path.read_bytes())
+        except (OSError,) + codec.DECODE_ERRORS:
+            return None
+
+    def _write(self, key: str, view: Dict[str, Optional[str]]):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(codec.dumps(view))
+            os.replace(tmp, path)
+        except OSError as e:
+            print("Failed to persist body view:", e)
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Optional[str]]]:
+        with self._lock:
+            view = self._views.get(key)
+            if view is not None:
+                self._views.move_to_end(key)
+                return view
+        view = self._read(key)
+        if view is not None:
+            self._remember(key, view)
+        return view
+
+    def get(self, body: Any, key: Optional[str] = None) -> Dict[str, Optional[str]]:
+        key = key or body_hash(body)
+        view = self._lookup(key)
+        if view is None:
+            view = normalize_body(body)
+            self._write(key, view)
+            self._remember(key, view)
+        return view
+
+    def for_email(self, email: Dict[str, Any]) -> Dict[str, Optional[str]]:
+        """
+        View of email["body"], using the "body_hash" stored on the email when present.
+
+        Fetch results drop "body" once its view is cached (see attach_body_view); if
+        that view is gone too, the body is read back from the email store.
+        """
+        body = email.get("body")
+        key = email.get("body_hash")
+        if body is None and key:
+            view = self._lookup(key)
+            if view is not None:
+                return view
+            stored = get_email_store().get_message(email.get("id"))
+            body = stored["body"] if stored else None
+        return self.get(body, key=key)
+
+
+class SanitizedHtmlCache:
+    """
+    bleach output keyed by the sha256 of the input HTML, computed the first time a
+    body is rendered. One Cleaner (ALLOWED_TAGS / ALLOWED_ATTRIBUTES) is reused for
+    every call; entries are evicted least recently used once their total size
+    passes `max_chars`.
+    """
+
+    def __init__(self, max_chars: int = SANITIZED_MAX_CHARS):
+        self.max_chars = max_chars
+        self._cleaner = Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True)
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # Cleaner keeps parser state between calls, so one clean() at a time.
+        self._clean_lock = threading.Lock()
+
+    def get(self, html: str) -> str:
+        key = hashlib.sha256(html.encode("utf-8")).hexdigest()
+        with self._lock:
+            safe = self._entries.get(key)
+            if safe is not None:
+                self._entries.move_to_end(key)
+                return safe
+        with self._clean_lock:
+            safe = self._cleaner.clean(html)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = safe
+                self._size += len(safe)
+            while self._size > self.max_chars and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return safe
+
+
+_default_cache: Optional[BodyViewCache] = None
+_default_sanitizer: Optional[SanitizedHtmlCache] = None
+_default_lock = threading.Lock()
+
+
+def get_body_cache() -> BodyViewCache:
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = BodyViewCache(BODY_VIEW_DIR)
+        return _default_cache
+
+
+def get_sanitizer() -> SanitizedHtmlCache:
+    global _default_sanitizer
+    with _default_lock:
+        if _default_sanitizer is None:
+            _default_sanitizer = SanitizedHtmlCache()
+        return _default_sanitizer
+
+
+def sanitize_html(html: Optional[str]) -> str:
+    """Sanitized copy of `html` for rendering (cached; see SanitizedHtmlCache)."""
+    return get_sanitizer().get(html) if html else ""
+
+
+def attach_body_view(email: Dict[str, Any]) -> Dict[str, Any]:
+    """Ingest step: normalize the body once and record its hash on the email."""
+    if email.get("body_loaded") is False:
+        return email
+    key = body_hash(email.get("body"))
+    get_body_cache().get(email.get("body"), key=key)
+    return {**email, "body_hash": key}
+
+
+def body_text(email: Dict[str, Any]) -> str:
+    """Plain text of an email's body, for prompts."""
+    return get_body_cache().for_email(email)["text"] or ""
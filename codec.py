@@ -0,0 +1,97 @@
+# codec.py
+#
+# JSON codec used for everything under data/. Picks the fastest installed backend
+# (orjson, then msgspec, then stdlib json); dumps() returns compact UTF-8 bytes.
+import json
+import os
+from typing import Any, Dict, List, Optional, TypedDict, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+BACKENDS = [name for name, mod in (("orjson", orjson), ("msgspec", msgspec)) if mod is not None] + ["json"]
+# EMAIL_AGENT_JSON_BACKEND=json forces a backend (e.g. to compare or debug).
+BACKEND = os.getenv("EMAIL_AGENT_JSON_BACKEND") or BACKENDS[0]
+if BACKEND not in BACKENDS:
+    raise ValueError(f"JSON backend {BACKEND!r} is not available (installed: {', '.join(BACKENDS)})")
+
+# What loads()/decode() can raise on malformed input, whichever backend is active.
+DECODE_ERRORS = (ValueError,) + ((msgspec.DecodeError,) if msgspec is not None else ())
+# What validate() raises when a value does not match its type (nothing without msgspec).
+VALIDATION_ERRORS = (msgspec.ValidationError,) if msgspec is not None else ()
+
+if msgspec is not None:
+    _msgspec_encoder = msgspec.json.Encoder()
+    _msgspec_decoder = msgspec.json.Decoder()
+
+
+class Draft(TypedDict, total=False):
+    email_id: Union[str, int, None]
+    original_subject: Optional[str]
+    draft_subject: str
+    draft_body: str
+    suggested_followups: List[Any]
+
+
+class Message(TypedDict, total=False):
+    """A stored email record (raw fetch dump / mock inbox entry)."""
+    id: Union[str, int]
+    threadId: Optional[str]
+    sender: Optional[str]
+    subject: Optional[str]
+    timestamp: Optional[str]
+    body: Any
+    attachments: List[Dict[str, Any]]
+    body_loaded: bool
+    raw_gmail: Dict[str, Any]
+
+
+Drafts = List[Draft]
+Messages = List[Message]
+
+
+def dumps(obj: Any, pretty: bool = False, backend: Optional[str] = None) -> bytes:
+    backend = backend or BACKEND
+    if backend == "orjson":
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if backend == "msgspec":
+        data = _msgspec_encoder.encode(obj)
+        return msgspec.json.format(data, indent=2) if pretty else data
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+    # ensure_ascii=False is ~3x slower to encode in the stdlib, so keep \u escapes.
+    return json.dumps(obj, separators=(",", ":")).encode("ascii")
+
+
+def loads(data: Union[bytes, str], backend: Optional[str] = None) -> Any:
+    backend = backend or BACKEND
+    if backend == "orjson":
+        return orjson.loads(data)
+    if backend == "msgspec":
+        return _msgspec_decoder.decode(data)
+    return json.loads(data)
+
+
+def decode(data: Union[bytes, str], type: Any = None, backend: Optional[str] = None) -> Any:
+    """
+    loads(), validated against `type` (e.g. Drafts, Messages) when msgspec is installed.
+
+    The TypedDicts decode to plain dicts, so callers are the same with or without msgspec.
+    """
+    if type is not None and msgspec is not None:
+        return msgspec.json.decode(data, type=type)
+    return loads(data, backend=backend)
+
+
+def validate(obj: Any, type: Any) -> Any:
+    """`obj` (already decoded) checked against `type` when msgspec is installed, else as-is."""
+    if msgspec is not None:
+        return msgspec.convert(obj, type=type)
+    return obj
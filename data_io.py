@@ -0,0 +1,183 @@
+# data_io.py
+import codecs
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import codec
+
+READ_CHUNK_CHARS = 1 << 16
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Serialises lock holders inside one process; the file lock covers other processes
+# (several `streamlit run` instances or scripts sharing data/).
+_process_lock = threading.RLock()
+
+
+def fsync_dir(path: Path):
+    if os.name == "nt":
+        return
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """Exclusive advisory lock on <path>.lock, held for the duration of the block."""
+    path = Path(path)
+    lock_path = path.with_name(path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with _process_lock:
+        with open(lock_path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """Write via a temp file in the same directory, fsync, then rename over `path`."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    fsync_dir(path.parent)
+
+
+def atomic_write_json(path: Path, obj: Any, pretty: bool = False):
+    atomic_write_bytes(path, codec.dumps(obj, pretty=pretty))
+
+
+def append_jsonl(path: Path, records: List[Dict[str, Any]]):
+    """Append one JSON line per record and fsync; the caller holds the file lock."""
+    data = b"".join(codec.dumps(r) + b"\n" for r in records)
+    with open(path, "ab+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                # Drop a torn line left by a crash so the new records start clean.
+                f.seek(0)
+                f.truncate(f.read().rfind(b"\n") + 1)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_jsonl(path: Path) -> List[Dict[str, Any]]:
+    """Records of a JSON-lines file; a torn last line (crash mid-append) is ignored."""
+    path = Path(path)
+    if not path.exists():
+        return []
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                records.append(codec.loads(line))
+            except codec.DECODE_ERRORS:
+                continue
+    return records
+
+
+def _skip_ws(buf: str, pos: int) -> int:
+    while pos < len(buf) and buf[pos] in " \t\r\n":
+        pos += 1
+    return pos
+
+
+def iter_json_records(path: Path, chunk_chars: int = READ_CHUNK_CHARS) -> Iterator[Any]:
+    """
+    Yield the elements of a top-level JSON array, or the records of a JSON-lines
+    file, one at a time.
+
+    The file is read in chunks and each element is decoded with raw_decode as soon
+    as it is complete, so memory holds one chunk plus one element, never the whole
+    file or the whole list. (Incremental decoding needs the stdlib decoder; the
+    codec backends only parse complete documents.)
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8-sig")()
+    with open(path, "rb") as f:
+        buf = ""
+        pos = 0
+        eof = False
+        want = chunk_chars
+
+        def fill() -> bool:
+            nonlocal buf, pos, eof
+            if eof:
+                return False
+            data = f.read(want)
+            eof = not data
+            # Drop what has been consumed before growing the buffer.
+            buf = buf[pos:] + text.decode(data, final=eof)
+            pos = 0
+            return bool(data)
+
+        pos = _skip_ws(buf, pos)
+        while pos >= len(buf) and fill():
+            pos = _skip_ws(buf, pos)
+        if pos >= len(buf):
+            return
+        is_array = buf[pos] == "["
+        if is_array:
+            pos += 1
+
+        while True:
+            pos = _skip_ws(buf, pos)
+            if pos < len(buf) and is_array and buf[pos] == ",":
+                pos = _skip_ws(buf, pos + 1)
+            if pos >= len(buf):
+                if fill():
+                    continue
+                if is_array:
+                    raise ValueError(f"{path}: unterminated JSON array")
+                return
+            if is_array and buf[pos] == "]":
+                return
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Element not complete yet: read more (in growing steps, so a single
+                # huge element is not re-parsed once per small chunk).
+                if not fill():
+                    raise
+                want = min(want * 2, 64 * 1024 * 1024)
+                continue
+            if end == len(buf) and not eof:
+                # A number (or literal) may continue in the next chunk.
+                if fill():
+                    continue
+            want = chunk_chars
+            pos = end
+            yield value
@@ -0,0 +1,288 @@
+# email_store.py
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DB_PATH = Path("data") / "agent.db"
+
+# Message IDs are declared without a type so SQLite keeps them as given: Gmail IDs
+# are strings, the mock inbox uses integers, and the app compares them as-is.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id NOT NULL PRIMARY KEY,
+    thread_id TEXT,
+    sender TEXT,
+    subject TEXT,
+    timestamp TEXT,
+    body_text TEXT,
+    body_html TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages(thread_id);
+CREATE INDEX IF NOT EXISTS idx_messages_updated ON messages(updated_at);
+
+CREATE TABLE IF NOT EXISTS results (
+    message_id NOT NULL PRIMARY KEY REFERENCES messages(id) ON DELETE CASCADE,
+    category TEXT,
+    category_reason TEXT,
+    action_items TEXT,
+    prompt_version INTEGER,
+    processed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_category ON results(category);
+
+CREATE TABLE IF NOT EXISTS drafts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email_id,
+    original_subject TEXT,
+    draft_subject TEXT,
+    draft_body TEXT,
+    suggested_followups TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_drafts_email ON drafts(email_id);
+
+CREATE TABLE IF NOT EXISTS prompt_versions (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    prompts TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, sender, body_text, content='messages', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, subject, sender, body_text)
+    VALUES (new.rowid, new.subject, new.sender, new.body_text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, subject, sender, body_text)
+    VALUES ('delete', old.rowid, old.subject, old.sender, old.body_text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, subject, sender, body_text)
+    VALUES ('delete', old.rowid, old.subject, old.sender, old.body_text);
+    INSERT INTO messages_fts(rowid, subject, sender, body_text)
+    VALUES (new.rowid, new.subject, new.sender, new.body_text);
+END;
+"""
+
+_SELECT_EMAIL = """
+SELECT m.id, m.thread_id, m.sender, m.subject, m.timestamp, m.body_text, m.body_html,
+       r.category, r.category_reason, r.action_items
+FROM messages m LEFT JOIN results r ON r.message_id = m.id
+"""
+
+
+def fts_query(text: str) -> str:
+    """
+    Plain search text as an FTS5 query: each word becomes a quoted string (embedded
+    quotes doubled), so "john@example.com", "C++" or "re: invoice" are matched as
+    text instead of being parsed as operators or column filters.
+    """
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+def _body_parts(email: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    body = email.get("body")
+    if isinstance(body, dict):
+        return body.get("text") or "", body.get("html")
+    return str(body or ""), None
+
+
+def _row_to_email(row: sqlite3.Row) -> Dict[str, Any]:
+    email = {
+        "id": row["id"],
+        "threadId": row["thread_id"],
+        "sender": row["sender"],
+        "subject": row["subject"],
+        "timestamp": row["timestamp"],
+        "body": {"text": row["body_text"], "html": row["body_html"]},
+    }
+    if row["category"] is not None:
+        email["category"] = row["category"]
+        email["category_reason"] = row["category_reason"] or ""
+        email["action_items"] = json.loads(row["action_items"] or "[]")
+    return email
+
+
+class EmailStore:
+    """
+    SQLite store (WAL mode) for messages, processing results, drafts and prompt
+    versions, with an FTS5 index over subject/sender/body text.
+
+    Each thread gets its own connection, so the store can be shared across
+    Streamlit sessions; reads are paginated and never load the whole table.
+    """
+
+    def __init__(self, path: Path = DB_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    # -- messages & results -------------------------------------------------
+
+    def upsert_messages(self, emails: Iterable[Dict[str, Any]]) -> int:
+        """Insert or update messages; an email without a "body" key keeps the stored body."""
+        now = time.time()
+        rows = []
+        for e in emails:
+            text, html = _body_parts(e)
+            rows.append((e.get("id"), e.get("threadId"), e.get("sender"), e.get("subject"),
+                         e.get("timestamp"), text, html, now, "body" in e))
+        with self._conn() as conn:
+            conn.executemany(
+                """
+                INSERT INTO messages (id, thread_id, sender, subject, timestamp, body_text, body_html, updated_at)
+                VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8)
+                ON CONFLICT(id) DO UPDATE SET
+                    thread_id = excluded.thread_id, sender = excluded.sender, subject = excluded.subject,
+                    timestamp = excluded.timestamp,
+                    body_text = CASE WHEN ?9 THEN excluded.body_text ELSE messages.body_text END,
+                    body_html = CASE WHEN ?9 THEN excluded.body_html ELSE messages.body_html END,
+                    updated_at = excluded.updated_at
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def save_results(self, emails: Iterable[Dict[str, Any]], prompt_version: Optional[int] = None) -> int:
+        """Record category/reason/action items for emails that have been processed."""
+        now = time.time()
+        rows = [
+            (e.get("id"), e.get("category"), e.get("category_reason", ""),
+             json.dumps(e.get("action_items") or []), prompt_version, now)
+            for e in emails if "category" in e
+        ]
+        with self._conn() as conn:
+            conn.executemany(
+                """
+                INSERT INTO results (message_id, category, category_reason, action_items, prompt_version, processed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(message_id) DO UPDATE SET
+                    category = excluded.category, category_reason = excluded.category_reason,
+                    action_items = excluded.action_items, prompt_version = excluded.prompt_version,
+                    processed_at = excluded.processed_at
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def upsert_processed(self, emails: List[Dict[str, Any]], prompt_version: Optional[int] = None) -> int:
+        self.upsert_messages(emails)
+        return self.save_results(emails, prompt_version=prompt_version)
+
+    def get_message(self, msg_id) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(_SELECT_EMAIL + " WHERE m.id = ?", (msg_id,)).fetchone()
+        return _row_to_email(row) if row else None
+
+    def count_messages(self, category: Optional[str] = None) -> int:
+        if category:
+            sql, args = "SELECT COUNT(*) FROM results WHERE category = ?", (category,)
+        else:
+            sql, args = "SELECT COUNT(*) FROM messages", ()
+        return self._conn().execute(sql, args).fetchone()[0]
+
+    def list_messages(self, limit: int = 50, offset: int = 0, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Most recently stored/updated messages first, one page at a time."""
+        if category:
+            sql = _SELECT_EMAIL + " WHERE r.category = ? ORDER BY m.updated_at DESC LIMIT ? OFFSET ?"
+            args: Tuple = (category, limit, offset)
+        else:
+            sql = _SELECT_EMAIL + " ORDER BY m.updated_at DESC LIMIT ? OFFSET ?"
+            args = (limit, offset)
+        return [_row_to_email(row) for row in self._conn().execute(sql, args)]
+
+    def search(self, query: str, limit: int = 50, offset: int = 0, raw: bool = False) -> List[Dict[str, Any]]:
+        """
+        Full-text search over subject, sender and body text, best matches first.
+
+        Every whitespace-separated word of `query` must appear, taken literally (see
+        fts_query). With raw=True, `query` is passed to MATCH as FTS5 query syntax.
+        """
+        match = query if raw else fts_query(query)
+        if not match:
+            return []
+        sql = (
+            _SELECT_EMAIL
+            + " JOIN messages_fts f ON f.rowid = m.rowid WHERE messages_fts MATCH ? ORDER BY f.rank LIMIT ? OFFSET ?"
+        )
+        return [_row_to_email(row) for row in self._conn().execute(sql, (match, limit, offset))]
+
+    # -- drafts -------------------------------------------------------------
+
+    def add_draft(self, record: Dict[str, Any]) -> int:
+        with self._conn() as conn:
+            cur = conn.execute(
+                """
+                INSERT INTO drafts (email_id, original_subject, draft_subject, draft_body, suggested_followups, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (record.get("email_id"), record.get("original_subject"), record.get("draft_subject"),
+                 record.get("draft_body"), json.dumps(record.get("suggested_followups") or []), time.time()),
+            )
+        return cur.lastrowid
+
+    def list_drafts(self, limit: int = 50, offset: int = 0, email_id=None) -> List[Dict[str, Any]]:
+        where, args = ("WHERE email_id = ?", [email_id]) if email_id is not None else ("", [])
+        rows = self._conn().execute(
+            f"SELECT * FROM drafts {where} ORDER BY id DESC LIMIT ? OFFSET ?", (*args, limit, offset)
+        )
+        return [
+            {
+                "email_id": row["email_id"],
+                "original_subject": row["original_subject"],
+                "draft_subject": row["draft_subject"],
+                "draft_body": row["draft_body"],
+                "suggested_followups": json.loads(row["suggested_followups"] or "[]"),
+            }
+            for row in rows
+        ]
+
+    # -- prompt versions ----------------------------------------------------
+
+    def save_prompt_version(self, prompts: Dict[str, Any]) -> int:
+        """Store `prompts` as a new version unless identical to the latest; returns its version."""
+        latest = self.latest_prompts()
+        if latest and latest[1] == prompts:
+            return latest[0]
+        with self._conn() as conn:
+            cur = conn.execute(
+                "INSERT INTO prompt_versions (prompts, created_at) VALUES (?, ?)",
+                (json.dumps(prompts, sort_keys=True), time.time()),
+            )
+        return cur.lastrowid
+
+    def latest_prompts(self) -> Optional[Tuple[int, Dict[str, Any]]]:
+        row = self._conn().execute(
+            "SELECT version, prompts FROM prompt_versions ORDER BY version DESC LIMIT 1"
+        ).fetchone()
+        return (row["version"], json.loads(row["prompts"])) if row else None
+
+
+_default_store: Optional[EmailStore] = None
+_default_lock = threading.Lock()
+
+
+def get_email_store() -> EmailStore:
+    """Process-wide EmailStore at DB_PATH."""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = EmailStore(DB_PATH)
+        return _default_store
@@ -0,0 +1,220 @@
+# gmail_async.py
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from gmail_client import (
+    _PARSERS,
+    METADATA_HEADERS,
+    LIST_PAGE_SIZE,
+    BATCH_MODIFY_SIZE,
+)
+from gmail_ratelimit import (
+    QUOTA_COSTS,
+    SHARED_BUCKET,
+    STATS,
+    MAX_RETRIES,
+    TokenBucket,
+    RetryStats,
+    backoff_delay,
+    error_reasons,
+    parse_retry_after,
+    status_is_rate_limited,
+    status_is_retryable,
+)
+
+GMAIL_API_ROOT = "https://gmail.googleapis.com/gmail/v1"
+
+
+class AsyncGmailError(Exception):
+    def __init__(self, status: int, message: str, reasons=()):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+        self.reasons = set(reasons)
+
+
+class AsyncGmailClient:
+    """
+    Minimal asyncio Gmail client (list/get/modify/labels) on one pooled httpx session.
+
+    Reuses the OAuth `creds` from gmail_client.get_credentials(), refreshing them off
+    the event loop when they expire. Pass `base_url` to point it at a fake server;
+    `creds=None` sends no Authorization header. Calls share the quota bucket and
+    retry policy of the synchronous client.
+    """
+
+    def __init__(
+        self,
+        creds: Optional[Credentials],
+        base_url: str = GMAIL_API_ROOT,
+        user_id: str = "me",
+        max_connections: int = 100,
+        http2: bool = False,
+        bucket: Optional[TokenBucket] = None,
+        stats: RetryStats = STATS,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.creds = creds
+        self.user_id = user_id
+        self.bucket = bucket or SHARED_BUCKET
+        self.stats = stats
+        self.max_retries = max_retries
+        self._refresh_lock = asyncio.Lock()
+        self._http = httpx.AsyncClient(
+            base_url=base_url.rstrip("/") + f"/users/{user_id}",
+            http2=http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(60.0),
+        )
+
+    async def __aenter__(self) -> "AsyncGmailClient":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    async def _auth_headers(self) -> Dict[str, str]:
+        if self.creds is None:
+            return {}
+        if not self.creds.valid:
+            async with self._refresh_lock:
+                if not self.creds.valid:
+                    await asyncio.to_thread(self.creds.refresh, Request())
+        return {"Authorization": f"Bearer {self.creds.token}"}
+
+    async def _request(self, method: str, path: str, quota_method: str, **kwargs) -> Dict[str, Any]:
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire_async(QUOTA_COSTS[quota_method])
+            try:
+                response = await self._http.request(method, path, headers=await self._auth_headers(), **kwargs)
+            except httpx.TransportError as exc:
+                if attempt == self.max_retries:
+                    self.stats.record(failures=1)
+                    raise AsyncGmailError(0, str(exc)) from exc
+                self.stats.record(retries=1)
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+
+            if response.status_code < 400:
+                self.bucket.recover()
+                return response.json() if response.content else {}
+
+            error = _error_from_response(response)
+            if not status_is_retryable(error.status, error.reasons) or attempt == self.max_retries:
+                self.stats.record(failures=1)
+                raise error
+            throttled = status_is_rate_limited(error.status, error.reasons)
+            if throttled:
+                self.bucket.throttle()
+            self.stats.record(retries=1, throttled=int(throttled))
+            delay = parse_retry_after(response.headers.get("retry-after"))
+            await asyncio.sleep(delay if delay is not None else backoff_delay(attempt))
+
+    async def get_profile(self) -> Dict[str, Any]:
+        try:
+            return await self._request("GET", "/profile", "getProfile")
+        except AsyncGmailError as error:
+            print("An error occurred fetching profile:", error)
+            return {}
+
+    async def iter_message_ids(
+        self,
+        query: Optional[str] = None,
+        max_results: Optional[int] = None,
+        page_size: int = LIST_PAGE_SIZE,
+    ) -> AsyncIterator[str]:
+        page_token = None
+        remaining = max_results
+        while remaining is None or remaining > 0:
+            params = {"maxResults": page_size if remaining is None else min(page_size, remaining)}
+            if query:
+                params["q"] = query
+            if page_token:
+                params["pageToken"] = page_token
+            try:
+                response = await self._request("GET", "/messages", "messages.list", params=params)
+            except AsyncGmailError as error:
+                print("An error occurred listing messages:", error)
+                return
+            for m in response.get("messages", []):
+                yield m["id"]
+                if remaining is not None:
+                    remaining -= 1
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return
+
+    async def get_message(self, msg_id: str, fmt: str = "full") -> Dict[str, Any]:
+        params: Dict[str, Any] = {"format": fmt}
+        if fmt == "metadata":
+            params["metadataHeaders"] = METADATA_HEADERS
+        try:
+            message = await self._request("GET", f"/messages/{msg_id}", "messages.get", params=params)
+        except AsyncGmailError as error:
+            print("An error occurred fetching message:", error)
+            return {}
+        parsed = _PARSERS[fmt](message)
+        parsed["id"] = msg_id
+        return parsed
+
+    async def get_messages(self, msg_ids: List[str], fmt: str = "full", concurrency: int = 200) -> List[Dict[str, Any]]:
+        """Fetch with up to `concurrency` requests in flight; order follows `msg_ids`, failures are dropped."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _one(msg_id: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.get_message(msg_id, fmt=fmt)
+
+        results = await asyncio.gather(*(_one(msg_id) for msg_id in msg_ids))
+        return [msg for msg in results if msg]
+
+    async def list_labels(self) -> List[Dict[str, Any]]:
+        response = await self._request("GET", "/labels", "labels.list")
+        return response.get("labels", [])
+
+    async def create_label(self, label_name: str) -> str:
+        body = {"labelListVisibility": "labelShow", "messageListVisibility": "show", "name": label_name}
+        label = await self._request("POST", "/labels", "labels.create", json=body)
+        return label["id"]
+
+    async def modify_message(self, msg_id: str, add_label_ids=None, remove_label_ids=None):
+        body = {"addLabelIds": add_label_ids or [], "removeLabelIds": remove_label_ids or []}
+        await self._request("POST", f"/messages/{msg_id}/modify", "messages.modify", json=body)
+
+    async def batch_modify_labels(
+        self,
+        msg_ids: List[str],
+        add_label_ids: Optional[List[str]] = None,
+        remove_label_ids: Optional[List[str]] = None,
+        chunk_size: int = BATCH_MODIFY_SIZE,
+    ) -> List[Dict[str, Any]]:
+        """Same contract as gmail_client.batch_modify_labels: one report per failed chunk."""
+        failures = []
+        for start in range(0, len(msg_ids), chunk_size):
+            chunk = msg_ids[start:start + chunk_size]
+            body = {"ids": chunk, "addLabelIds": add_label_ids or [], "removeLabelIds": remove_label_ids or []}
+            try:
+                await self._request("POST", "/messages/batchModify", "messages.batchModify", json=body)
+            except AsyncGmailError as error:
+                print(f"Error modifying labels on {len(chunk)} messages:", error)
+                failures.append({"ids": chunk, "status": error.status, "error": str(error)})
+        return failures
+
+
+def _error_from_response(response: httpx.Response) -> AsyncGmailError:
+    message = response.text
+    reasons = set()
+    try:
+        payload = response.json()
+        message = payload.get("error", {}).get("message", message)
+        reasons = error_reasons(payload)
+    except Exception:
+        pass
+    return AsyncGmailError(response.status_code, message, reasons)
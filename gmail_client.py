@@ -1,34 +1,75 @@
 import os
 import base64
-import json
+import binascii
+import hashlib
+import codec
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
 
-from bs4 import BeautifulSoup
-import bleach
+from email import policy as email_policy
+from email.parser import BytesParser
+
+from data_io import atomic_write_bytes, atomic_write_json
+from html_text import html_to_text
+
+from gmail_ratelimit import (
+    TokenBucket,
+    QUOTA_COSTS,
+    SHARED_BUCKET,
+    STATS,
+    execute_with_retry,
+    error_status,
+    is_retryable,
+    is_rate_limited,
+    backoff_delay,
+    MAX_RETRIES,
+)
 
 CREDS_PATH = Path("credentials.json")
 TOKEN_PATH = Path("token.json")
+LABEL_CACHE_PATH = Path("data") / "label_cache.json"
+ATTACHMENT_CACHE_DIR = Path("data") / "attachments"
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
 
-ALLOWED_TAGS = [
-    "a", "b", "i", "strong", "em", "p", "br", "ul", "ol", "li", "blockquote", "code", "pre",
-    "h1", "h2", "h3", "h4", "table", "thead", "tbody", "tr", "td", "th", "img"
-]
-ALLOWED_ATTRIBUTES = {
-    "a": ["href", "title", "rel", "target"],
-    "img": ["src", "alt", "title", "width", "height"],
-    "*": ["style"]
-}
+# The background refresher renews the token this long before it expires.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
 
+# Gmail accepts at most 100 calls in a single batch HTTP request.
+BATCH_SIZE = 100
+# Headers requested for format="metadata" fetches.
+METADATA_HEADERS = ["Subject", "From", "Date"]
+# Largest page users.messages.list will return.
+LIST_PAGE_SIZE = 500
+# users.messages.batchModify accepts at most 1000 IDs per call.
+BATCH_MODIFY_SIZE = 1000
 
-def gmail_authenticate() -> Any:
+
+def _execute(request, method: str, bucket: Optional[TokenBucket] = None) -> Any:
+    return execute_with_retry(request, cost=QUOTA_COSTS[method], bucket=bucket)
+
+
+class HistoryExpiredError(Exception):
+    """The stored startHistoryId is too old for users.history.list; a full resync is needed."""
+
+
+def _save_token(creds: Credentials):
+    with open(TOKEN_PATH, "w") as token_file:
+        token_file.write(creds.to_json())
+
+
+def _load_credentials() -> Credentials:
     creds = None
     if TOKEN_PATH.exists():
         creds = Credentials.from_authorized_user_file(TOKEN_PATH, SCOPES)
@@ -38,134 +79,729 @@ def gmail_authenticate() -> Any:
         else:
             flow = InstalledAppFlow.from_client_secrets_file(str(CREDS_PATH), SCOPES)
             creds = flow.run_local_server(port=0)
-        with open(TOKEN_PATH, "w") as token_file:
-            token_file.write(creds.to_json())
+        _save_token(creds)
+    return creds
 
-    service = build("gmail", "v1", credentials=creds)
-    return service
 
+_creds_lock = threading.Lock()
+_cached_creds: Optional[Credentials] = None
+_refresher: Optional[threading.Thread] = None
 
-def list_message_ids(service, user_id="me", query: Optional[str] = None, max_results: int = 100) -> List[str]:
+
+def _utcnow() -> datetime:
+    # google-auth keeps `expiry` as a naive UTC datetime.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _refresh_loop():
+    """Refresh the cached token TOKEN_REFRESH_MARGIN before it expires, off the request path."""
+    while True:
+        creds = _cached_creds
+        if creds is None or creds.expiry is None or not creds.refresh_token:
+            time.sleep(60)
+            continue
+        wait = (creds.expiry - TOKEN_REFRESH_MARGIN - _utcnow()).total_seconds()
+        if wait > 0:
+            time.sleep(min(wait, 300))
+            continue
+        try:
+            with _creds_lock:
+                creds.refresh(Request())
+                _save_token(creds)
+        except Exception as error:
+            print("Background token refresh failed:", error)
+            time.sleep(60)
+
+
+def get_credentials() -> Credentials:
+    """
+    Return process-wide OAuth credentials, loading token.json (or running the OAuth
+    flow) only once. A daemon thread keeps the token fresh in the background.
+    """
+    global _cached_creds, _refresher
+    with _creds_lock:
+        if _cached_creds is not None and not _cached_creds.valid and _cached_creds.refresh_token:
+            _cached_creds.refresh(Request())
+            _save_token(_cached_creds)
+        if _cached_creds is None or not _cached_creds.valid:
+            _cached_creds = _load_credentials()
+        if _refresher is None:
+            _refresher = threading.Thread(target=_refresh_loop, name="gmail-token-refresh", daemon=True)
+            _refresher.start()
+        return _cached_creds
+
+
+def build_service(creds: Credentials) -> Any:
+    # The discovery document bundled with google-api-python-client is used, so
+    # building a service never fetches it over the network.
+    return build("gmail", "v1", credentials=creds, static_discovery=True, cache_discovery=False)
+
+
+def gmail_authenticate() -> Any:
+    """Authenticate and return a new Gmail service owned by the caller (see gmail_service for the pooled one)."""
+    return build_service(get_credentials())
+
+
+def clear_service_cache():
+    """Forget cached credentials and pooled services, e.g. after token.json was replaced."""
+    global _cached_creds
+    with _creds_lock:
+        _cached_creds = None
+    _reset_service_pool(None)
+
+
+# Services shared by the whole process (every Streamlit rerun and worker thread).
+# httplib2 is not thread-safe, so a service is checked out for one caller at a
+# time and put back afterwards; the pool grows to the peak number of concurrent users.
+_service_pool: "queue.Queue[Any]" = queue.Queue()
+_pool_creds: Optional[Credentials] = None
+_pool_lock = threading.Lock()
+
+
+def _reset_service_pool(creds: Optional[Credentials]):
+    global _pool_creds
+    with _pool_lock:
+        _pool_creds = creds
+        while True:
+            try:
+                _service_pool.get_nowait()
+            except queue.Empty:
+                break
+
+
+@contextmanager
+def gmail_service(creds: Optional[Credentials] = None) -> Iterator[Any]:
+    """
+    Check a Gmail service out of the process-wide pool for the duration of the block.
+
+    Services are built only when the pool is empty, and are dropped when the
+    credentials change (get_credentials() returns a different object).
+    """
+    creds = creds or get_credentials()
+    if _pool_creds is not creds:
+        _reset_service_pool(creds)
     try:
-        response = service.users().messages().list(userId=user_id, q=query, maxResults=max_results).execute()
-        msgs = response.get("messages", [])
-        return [m["id"] for m in msgs]
-    except HttpError as error:
-        print("An error occurred listing messages:", error)
-        return []
+        service = _service_pool.get_nowait()
+    except queue.Empty:
+        service = build_service(creds)
+    try:
+        yield service
+    finally:
+        with _pool_lock:
+            if _pool_creds is creds:
+                _service_pool.put(service)
+
+
+def iter_message_ids(
+    service,
+    user_id="me",
+    query: Optional[str] = None,
+    max_results: Optional[int] = None,
+    page_size: int = LIST_PAGE_SIZE,
+) -> Iterator[str]:
+    """
+    Yield message IDs page by page, following nextPageToken lazily.
+
+    The next page is only requested once the caller has consumed the current one,
+    so processing can start on the first page and memory stays flat.
+    """
+    page_token = None
+    remaining = max_results
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        try:
+            response = _execute(service.users().messages().list(
+                userId=user_id, q=query, maxResults=size, pageToken=page_token
+            ), "messages.list")
+        except HttpError as error:
+            print("An error occurred listing messages:", error)
+            return
+        for m in response.get("messages", []):
+            yield m["id"]
+            if remaining is not None:
+                remaining -= 1
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
 
 
-def get_message(service, msg_id: str, user_id="me") -> Dict[str, Any]:
+def list_message_ids(service, user_id="me", query: Optional[str] = None, max_results: int = 100) -> List[str]:
+    return list(iter_message_ids(service, user_id=user_id, query=query, max_results=max_results))
+
+
+def get_profile(service, user_id="me") -> Dict[str, Any]:
     try:
-        message = service.users().messages().get(userId=user_id, id=msg_id, format="full").execute()
+        return _execute(service.users().getProfile(userId=user_id), "getProfile")
     except HttpError as error:
-        print("An error occurred fetching message:", error)
+        print("An error occurred fetching profile:", error)
         return {}
 
+
+def list_history_message_ids(
+    service,
+    start_history_id: str,
+    user_id="me",
+    label_id: Optional[str] = "INBOX",
+    page_size: int = LIST_PAGE_SIZE,
+) -> Tuple[List[str], str]:
+    """
+    List IDs of messages added since `start_history_id` via users.history.list.
+
+    Returns (message_ids, latest_history_id). Raises HistoryExpiredError when Gmail
+    answers 404, meaning the history ID has expired and the caller must resync.
+    """
+    ids: Dict[str, None] = {}
+    latest_history_id = start_history_id
+    page_token = None
+    while True:
+        try:
+            response = _execute(service.users().history().list(
+                userId=user_id,
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded"],
+                labelId=label_id,
+                maxResults=page_size,
+                pageToken=page_token,
+            ), "history.list")
+        except HttpError as error:
+            if error_status(error) == 404:
+                raise HistoryExpiredError(start_history_id) from error
+            print("An error occurred listing history:", error)
+            return list(ids), start_history_id
+        for record in response.get("history", []):
+            for added in record.get("messagesAdded", []):
+                ids[added["message"]["id"]] = None
+        latest_history_id = response.get("historyId", latest_history_id)
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return list(ids), latest_history_id
+
+
+def _header_dict(payload: Dict[str, Any]) -> Dict[str, str]:
+    return {h["name"].lower(): h["value"] for h in payload.get("headers", [])}
+
+
+def _parse_message(message: Dict[str, Any]) -> Dict[str, Any]:
     payload = message.get("payload", {})
-    headers = payload.get("headers", [])
-    header_dict = {h["name"].lower(): h["value"] for h in headers}
+    header_dict = _header_dict(payload)
 
     subject = header_dict.get("subject", "(no subject)")
     sender = header_dict.get("from", "(unknown)")
     date = header_dict.get("date", "")
-    body = extract_message_body(payload)
+    body, attachments = _extract_body_and_attachments(payload)
+    if attachments:
+        message = {**message, "payload": _strip_attachment_data(payload)}
 
     return {
-        "id": msg_id,
+        "id": message.get("id"),
         "threadId": message.get("threadId"),
         "subject": subject,
         "sender": sender,
         "timestamp": date,
         "body": body,
+        "attachments": attachments,
         "raw_gmail": message
     }
 
 
-def _html_to_text(html: str) -> str:
-    if not html:
-        return ""
-    soup = BeautifulSoup(html, "html.parser")
-    for tag in soup(["script", "style"]):
-        tag.decompose()
-    text = soup.get_text(separator="\n")
-    lines = [line.strip() for line in text.splitlines()]
-    return "\n".join([ln for ln in lines if ln])
+def _parse_metadata_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    header_dict = _header_dict(message.get("payload", {}))
+    return {
+        "id": message.get("id"),
+        "threadId": message.get("threadId"),
+        "subject": header_dict.get("subject", "(no subject)"),
+        "sender": header_dict.get("from", "(unknown)"),
+        "timestamp": header_dict.get("date", ""),
+        "body": {"text": message.get("snippet", ""), "html": None},
+        "body_loaded": False,
+        "raw_gmail": message
+    }
 
 
-def _extract_parts(part):
-    plain_parts = []
-    html_parts = []
+def _parse_raw_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    # format="raw" returns the whole RFC 822 message as one base64url blob; that blob
+    # (not a decoded JSON part tree) is what gets kept in raw_gmail.
+    parsed = parse_raw_mime(base64.urlsafe_b64decode(message.get("raw", "")))
+    return {
+        "id": message.get("id"),
+        "threadId": message.get("threadId"),
+        **parsed,
+        "raw_gmail": message
+    }
 
-    mimeType = part.get("mimeType", "")
-    body = part.get("body", {}) or {}
 
-    if mimeType == "text/plain" and body.get("data"):
-        try:
-            data = base64.urlsafe_b64decode(body["data"].encode("ASCII")).decode("utf-8", errors="replace")
-            plain_parts.append(data)
-        except Exception:
-            pass
-    elif mimeType == "text/html" and body.get("data"):
+_PARSERS = {
+    "full": _parse_message,
+    "metadata": _parse_metadata_message,
+    "raw": _parse_raw_message,
+}
+
+
+def _get_request(service, msg_id: str, user_id="me", fmt: str = "full"):
+    if fmt == "metadata":
+        return service.users().messages().get(userId=user_id, id=msg_id, format=fmt, metadataHeaders=METADATA_HEADERS)
+    return service.users().messages().get(userId=user_id, id=msg_id, format=fmt)
+
+
+def get_message(
+    service,
+    msg_id: str,
+    user_id="me",
+    fmt: str = "full",
+    bucket: Optional[TokenBucket] = None,
+) -> Dict[str, Any]:
+    """
+    Fetch one message. `fmt` is "full" (default), "metadata" (headers + snippet only)
+    or "raw" (one RFC 822 blob parsed locally).
+    """
+    try:
+        message = _execute(_get_request(service, msg_id, user_id=user_id, fmt=fmt), "messages.get", bucket=bucket)
+    except HttpError as error:
+        print("An error occurred fetching message:", error)
+        return {}
+
+    parsed = _PARSERS[fmt](message)
+    parsed["id"] = msg_id
+    return parsed
+
+
+def get_messages_batch(
+    service,
+    msg_ids: List[str],
+    user_id="me",
+    batch_size: int = BATCH_SIZE,
+    fmt: str = "full",
+) -> List[Dict[str, Any]]:
+    """
+    Fetch many messages with one batch HTTP request per `batch_size` IDs.
+
+    Returns the same parsed dicts as `get_message`, in the order of `msg_ids`.
+    Sub-requests that fail with 429/5xx are re-sent in a follow-up batch after a
+    backoff; anything still failing, and every non-retryable failure, is reported,
+    counted in STATS and left out, like `get_message` returning an empty dict.
+    """
+    msg_ids = list(dict.fromkeys(msg_ids))
+    results: Dict[str, Dict[str, Any]] = {}
+    errors: Dict[str, HttpError] = {}
+    parse = _PARSERS[fmt]
+
+    def _callback(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+            return
+        parsed = parse(response)
+        parsed["id"] = request_id
+        results[request_id] = parsed
+
+    for start in range(0, len(msg_ids), batch_size):
+        pending = msg_ids[start:start + batch_size]
+        for attempt in range(MAX_RETRIES + 1):
+            errors.clear()
+            batch = service.new_batch_http_request(callback=_callback)
+            for msg_id in pending:
+                batch.add(_get_request(service, msg_id, user_id=user_id, fmt=fmt), request_id=msg_id)
+            try:
+                execute_with_retry(batch, cost=QUOTA_COSTS["messages.get"] * len(pending))
+            except HttpError as error:
+                print("An error occurred executing batch:", error)
+                break
+
+            retry = [i for i, e in errors.items() if isinstance(e, HttpError) and is_retryable(e)]
+            if attempt == MAX_RETRIES:
+                retry = []
+            # Failures are counted per attempt: errors is cleared before the next one.
+            failed = [i for i in errors if i not in retry]
+            for msg_id in failed:
+                print("An error occurred fetching message:", errors[msg_id])
+            if failed:
+                STATS.record(failures=len(failed))
+            if not retry:
+                break
+            throttled = [errors[i] for i in retry if is_rate_limited(errors[i])]
+            if throttled:
+                SHARED_BUCKET.throttle()
+            STATS.record(retries=len(retry), throttled=len(throttled))
+            time.sleep(max(backoff_delay(attempt, errors[i]) for i in retry))
+            pending = retry
+
+    return [results[msg_id] for msg_id in msg_ids if msg_id in results]
+
+
+def iter_threads(
+    service,
+    user_id="me",
+    query: Optional[str] = None,
+    max_results: Optional[int] = None,
+    page_size: int = LIST_PAGE_SIZE,
+) -> Iterator[Dict[str, Any]]:
+    """Yield {"id", "historyId", "snippet"} per thread from users.threads.list, following pages lazily."""
+    page_token = None
+    remaining = max_results
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
         try:
-            data = base64.urlsafe_b64decode(body["data"].encode("ASCII")).decode("utf-8", errors="replace")
-            html_parts.append(data)
-        except Exception:
-            pass
+            response = _execute(service.users().threads().list(
+                userId=user_id, q=query, maxResults=size, pageToken=page_token
+            ), "threads.list")
+        except HttpError as error:
+            print("An error occurred listing threads:", error)
+            return
+        for t in response.get("threads", []):
+            yield t
+            if remaining is not None:
+                remaining -= 1
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def get_thread(service, thread_id: str, user_id="me", fmt: str = "full") -> Dict[str, Any]:
+    """
+    Fetch a whole thread with users.threads.get. Returns {"id", "historyId", "messages"}
+    where messages are parsed like get_message ("full" or "metadata"; threads have no
+    "raw" format). Returns {} on error.
+    """
+    try:
+        thread = _execute(service.users().threads().get(userId=user_id, id=thread_id, format=fmt), "threads.get")
+    except HttpError as error:
+        print("An error occurred fetching thread:", error)
+        return {}
+    return {
+        "id": thread.get("id", thread_id),
+        "historyId": thread.get("historyId"),
+        "messages": [_PARSERS[fmt](m) for m in thread.get("messages", [])],
+    }
 
-    for sub in part.get("parts", []) or []:
-        p, h = _extract_parts(sub)
-        plain_parts.extend(p)
-        html_parts.extend(h)
 
-    return plain_parts, html_parts
+def get_messages_concurrent(
+    creds: Credentials,
+    msg_ids: List[str],
+    user_id="me",
+    workers: int = 8,
+    fmt: str = "full",
+    bucket: Optional[TokenBucket] = None,
+    pool: Optional[ThreadPoolExecutor] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Fetch messages on a pool of `workers` threads, each call using a service checked
+    out of the process-wide pool (gmail_service).
+
+    Requests are paced by `bucket` (a TokenBucket in Gmail quota units, shared by all
+    workers; SHARED_BUCKET by default) instead of a fixed sleep. Pass a long-lived `pool`
+    to reuse worker threads across calls. Returns parsed
+    dicts in the order of `msg_ids`; failed fetches are left out.
+    """
+    def _fetch(msg_id: str) -> Dict[str, Any]:
+        with gmail_service(creds) as service:
+            return get_message(service, msg_id, user_id=user_id, fmt=fmt, bucket=bucket)
+
+    if pool is not None:
+        return [msg for msg in pool.map(_fetch, msg_ids) if msg]
+    with ThreadPoolExecutor(max_workers=workers) as own_pool:
+        return [msg for msg in own_pool.map(_fetch, msg_ids) if msg]
+
+
+def _is_attachment_part(part: Dict[str, Any]) -> bool:
+    body = part.get("body", {}) or {}
+    return bool(part.get("filename")) or bool(body.get("attachmentId"))
+
+
+def _attachment_info(part: Dict[str, Any]) -> Dict[str, Any]:
+    body = part.get("body", {}) or {}
+    return {
+        "filename": part.get("filename", ""),
+        "mimeType": part.get("mimeType", ""),
+        "size": body.get("size", 0),
+        "attachmentId": body.get("attachmentId"),
+        "partId": part.get("partId"),
+    }
+
+
+# Maps the base64url alphabet onto standard base64 for binascii.
+_URLSAFE_TO_STD = bytes.maketrans(b"-_", b"+/")
+
+
+def _decode_part_data(data: str) -> Optional[str]:
+    """Gmail part data (base64url, padding optional) decoded as UTF-8 text."""
+    try:
+        raw = data.encode("ascii").translate(_URLSAFE_TO_STD)
+        if len(raw) % 4:
+            raw += b"=" * (-len(raw) % 4)
+        return binascii.a2b_base64(raw).decode("utf-8", errors="replace")
+    except (UnicodeEncodeError, binascii.Error):
+        return None
+
+
+def _walk_parts(payload: Dict[str, Any]) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+    """
+    Single iterative pass over a payload tree, in document order.
+
+    Returns the decoded text/plain parts, the decoded text/html parts and the
+    attachment metadata. Attachment parts are recorded but never decoded or descended
+    into. A single-part message whose top-level type is neither text/html nor
+    text/plain is read as plain text.
+    """
+    plain_parts: List[str] = []
+    html_parts: List[str] = []
+    attachments: List[Dict[str, Any]] = []
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        body = part.get("body") or {}
+        if part.get("filename") or body.get("attachmentId"):
+            attachments.append(_attachment_info(part))
+            continue
+        data = body.get("data")
+        if data:
+            mime_type = part.get("mimeType", "")
+            if mime_type == "text/html":
+                target = html_parts
+            elif mime_type == "text/plain" or part is payload:
+                target = plain_parts
+            else:
+                target = None
+            if target is not None:
+                text = _decode_part_data(data)
+                if text is not None:
+                    target.append(text)
+        subparts = part.get("parts")
+        if subparts:
+            stack.extend(reversed(subparts))
+    return plain_parts, html_parts, attachments
+
+
+def _extract_body_and_attachments(payload) -> Tuple[Dict[str, Optional[str]], List[Dict[str, Any]]]:
+    plain_parts, html_parts, attachments = _walk_parts(payload)
+    return _assemble_body(plain_parts, html_parts), attachments
 
 
 def extract_message_body(payload) -> Dict[str, Optional[str]]:
-    if payload.get("body", {}).get("data"):
-        try:
-            raw = base64.urlsafe_b64decode(payload["body"]["data"].encode("ASCII")).decode("utf-8", errors="replace")
-            return {"text": raw, "html": None}
-        except Exception:
-            pass
+    return _extract_body_and_attachments(payload)[0]
+
 
-    plain_parts, html_parts = _extract_parts(payload)
+def _strip_attachment_data(part: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Copy of a payload tree with attachment bytes removed. Only parts that carry an
+    attachmentId are stripped, so the data can always be fetched again on demand.
+    """
+    if _is_attachment_part(part) and (part.get("body") or {}).get("attachmentId"):
+        body = {k: v for k, v in (part.get("body") or {}).items() if k != "data"}
+        return {**part, "body": body}
+    if part.get("parts"):
+        return {**part, "parts": [_strip_attachment_data(sub) for sub in part["parts"]]}
+    return part
 
+
+def _assemble_body(plain_parts: List[str], html_parts: List[str]) -> Dict[str, Optional[str]]:
     if plain_parts:
         text = "\n\n".join(plain_parts)
         html = "\n\n".join(html_parts) if html_parts else None
-        safe_html = bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True) if html else None
-        return {"text": text, "html": safe_html}
+        return {"text": text, "html": html}
 
     if html_parts:
         html = "\n\n".join(html_parts)
-        safe_html = bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True)
-        text = _html_to_text(html)
-        return {"text": text, "html": safe_html}
+        return {"text": html_to_text(html), "html": html}
+
+    return {"text": "", "html": None}
+
+
+def _mime_part_size(part) -> int:
+    """Decoded size of a MIME part, like Gmail's body.size."""
+    data = part.get_payload(decode=True)
+    if data is None:
+        # message/rfc822 (or multipart) attachments: the size of the embedded entities.
+        return sum(len(sub.as_bytes()) for sub in part.get_payload() or [])
+    return len(data)
+
+
+def parse_raw_mime(raw: bytes) -> Dict[str, Any]:
+    """
+    Parse an RFC 822 message into subject/sender/timestamp/body with the stdlib email package.
+
+    Walked like _walk_parts: attachments (including forwarded message/rfc822 parts)
+    are recorded but never descended into, so their text stays out of the body.
+    """
+    msg = BytesParser(policy=email_policy.default).parsebytes(raw)
+    plain_parts, html_parts, attachments = [], [], []
+    stack = [msg]
+    while stack:
+        part = stack.pop()
+        if part.is_attachment() or part.get_filename():
+            attachments.append({
+                "filename": part.get_filename() or "",
+                "mimeType": part.get_content_type(),
+                # The bytes themselves stay in the stored raw blob.
+                "size": _mime_part_size(part),
+                "attachmentId": None,
+                "partId": None,
+            })
+            continue
+        if part.is_multipart():
+            stack.extend(reversed(part.get_payload()))
+            continue
+        content_type = part.get_content_type()
+        if content_type not in ("text/plain", "text/html"):
+            continue
+        try:
+            content = part.get_content()
+        except Exception:
+            content = (part.get_payload(decode=True) or b"").decode("utf-8", errors="replace")
+        (plain_parts if content_type == "text/plain" else html_parts).append(content)
+
+    return {
+        "subject": str(msg.get("subject", "(no subject)")),
+        "sender": str(msg.get("from", "(unknown)")),
+        "timestamp": str(msg.get("date", "")),
+        "body": _assemble_body(plain_parts, html_parts),
+        "attachments": attachments,
+    }
 
-    return {"text": text, "html": safe_html}
+
+def get_attachment(service, msg_id: str, attachment_id: str, user_id="me") -> bytes:
+    """
+    Download one attachment via users.messages.attachments.get, on demand.
+
+    Results are cached in ATTACHMENT_CACHE_DIR keyed by attachmentId (hashed, since
+    Gmail attachment IDs are longer than most filesystems allow for a filename).
+    """
+    cache_path = ATTACHMENT_CACHE_DIR / (hashlib.sha256(attachment_id.encode("utf-8")).hexdigest() + ".bin")
+    if cache_path.exists():
+        return cache_path.read_bytes()
+    try:
+        response = _execute(
+            service.users().messages().attachments().get(userId=user_id, messageId=msg_id, id=attachment_id),
+            "messages.attachments.get",
+        )
+    except HttpError as error:
+        print("An error occurred fetching attachment:", error)
+        return b""
+    data = base64.urlsafe_b64decode(response.get("data", ""))
+    # Unique temp name per writer, so concurrent downloads of one attachment cannot collide.
+    atomic_write_bytes(cache_path, data)
+    return data
+
+
+def _create_label(service, label_name: str, user_id="me") -> str:
+    label_body = {
+        "labelListVisibility": "labelShow",
+        "messageListVisibility": "show",
+        "name": label_name
+    }
+    label = _execute(service.users().labels().create(userId=user_id, body=label_body), "labels.create")
+    return label["id"]
 
 
 def create_label_if_not_exists(service, label_name="Processed", user_id="me") -> str:
     try:
-        labels = service.users().labels().list(userId=user_id).execute().get("labels", [])
+        labels = _execute(service.users().labels().list(userId=user_id), "labels.list").get("labels", [])
         for lbl in labels:
             if lbl.get("name") == label_name:
                 return lbl["id"]
-        label_body = {
-            "labelListVisibility": "labelShow",
-            "messageListVisibility": "show",
-            "name": label_name
-        }
-        label = service.users().labels().create(userId=user_id, body=label_body).execute()
-        return label["id"]
+        return _create_label(service, label_name, user_id=user_id)
     except HttpError as error:
         print("Error creating label:", error)
         return ""
 
 
+class LabelRegistry:
+    """
+    Resolves label names to IDs and remembers them per account in LABEL_CACHE_PATH,
+    so labels.list only runs on a cache miss.
+    """
+
+    def __init__(self, service, account: str, user_id="me", path: Path = LABEL_CACHE_PATH):
+        self.service = service
+        self.account = account
+        self.user_id = user_id
+        self.path = path
+        self._cache = self._load_all()
+        self._labels: Dict[str, str] = self._cache.setdefault(account, {})
+
+    def _load_all(self) -> Dict[str, Dict[str, str]]:
+        if self.path.exists():
+            try:
+                return codec.loads(self.path.read_bytes() or b"{}")
+            except Exception:
+                return {}
+        return {}
+
+    def _save(self):
+        atomic_write_json(self.path, self._cache)
+
+    def name_for(self, label_id: str) -> Optional[str]:
+        return next((name for name, lid in self._labels.items() if lid == label_id), None)
+
+    def cached(self, label_name: str) -> str:
+        """ID from the cache only ("" on a miss); never calls the API."""
+        return self._labels.get(label_name, "")
+
+    def resolve(self, label_name: str, create: bool = True) -> str:
+        if label_name in self._labels:
+            return self._labels[label_name]
+        return self.warm_up([label_name], create=create).get(label_name, "")
+
+    def warm_up(self, label_names: List[str], create: bool = True) -> Dict[str, str]:
+        """Resolve (and optionally create) several labels with a single labels.list call."""
+        missing = self.missing(label_names)
+        if missing:
+            try:
+                labels = _execute(self.service.users().labels().list(userId=self.user_id), "labels.list").get("labels", [])
+                existing = {lbl.get("name"): lbl["id"] for lbl in labels}
+                for name in missing:
+                    if name in existing:
+                        self._labels[name] = existing[name]
+                    elif create:
+                        self._labels[name] = _create_label(self.service, name, user_id=self.user_id)
+            except HttpError as error:
+                print("Error resolving labels:", error)
+            self._save()
+        return {name: self._labels[name] for name in label_names if name in self._labels}
+
+    def missing(self, label_names: List[str]) -> List[str]:
+        return [name for name in label_names if name not in self._labels]
+
+    def remember(self, mapping: Dict[str, str]):
+        """Record name -> ID pairs resolved elsewhere (e.g. by the async client)."""
+        self._labels.update({name: lid for name, lid in mapping.items() if lid})
+        self._save()
+
+    def invalidate(self, label_id: str) -> Optional[str]:
+        """Forget a label ID Gmail no longer recognises; returns its name, if known."""
+        name = self.name_for(label_id)
+        if name is not None:
+            del self._labels[name]
+            self._save()
+        return name
+
+
 def add_label_to_message(service, msg_id: str, label_id: str, user_id="me"):
     try:
-        service.users().messages().modify(userId=user_id, id=msg_id, body={"addLabelIds": [label_id]}).execute()
+        _execute(service.users().messages().modify(userId=user_id, id=msg_id, body={"addLabelIds": [label_id]}), "messages.modify")
     except HttpError as error:
         print("Error adding label:", error)
+
+
+def batch_modify_labels(
+    service,
+    msg_ids: List[str],
+    add_label_ids: Optional[List[str]] = None,
+    remove_label_ids: Optional[List[str]] = None,
+    user_id="me",
+    chunk_size: int = BATCH_MODIFY_SIZE,
+) -> List[Dict[str, Any]]:
+    """
+    Add/remove labels on many messages with users.messages.batchModify.
+
+    IDs are sent in chunks of up to `chunk_size`. Returns one report per failed
+    chunk: {"ids": [...], "status": <HTTP status or None>, "error": "..."}.
+    """
+    failures = []
+    for start in range(0, len(msg_ids), chunk_size):
+        chunk = msg_ids[start:start + chunk_size]
+        body = {"ids": chunk, "addLabelIds": add_label_ids or [], "removeLabelIds": remove_label_ids or []}
+        try:
+            _execute(service.users().messages().batchModify(userId=user_id, body=body), "messages.batchModify")
+        except HttpError as error:
+            print(f"Error modifying labels on {len(chunk)} messages:", error)
+            failures.append({"ids": chunk, "status": error_status(error), "error": str(error)})
+    return failures
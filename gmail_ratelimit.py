@@ -0,0 +1,228 @@
+# gmail_ratelimit.py
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Set
+
+from googleapiclient.errors import HttpError
+
+# Gmail allows 250 quota units per user per second.
+USER_QUOTA_UNITS_PER_SECOND = 250
+
+# Quota units charged per call (https://developers.google.com/gmail/api/reference/quota).
+QUOTA_COSTS = {
+    "getProfile": 1,
+    "labels.list": 1,
+    "labels.create": 5,
+    "history.list": 2,
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.modify": 5,
+    "messages.batchModify": 50,
+    "messages.attachments.get": 5,
+    "threads.list": 10,
+    "threads.get": 10,
+}
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Gmail also signals rate limiting as 403 with one of these reasons: the legacy
+# error.errors[].reason values, or the ErrorInfo reason in error.details[].
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "RATE_LIMIT_EXCEEDED"}
+
+MAX_RETRIES = 5
+BASE_DELAY = 1.0
+MAX_DELAY = 32.0
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket measured in Gmail quota units.
+
+    Tokens refill continuously at `rate` per second up to `capacity`; `acquire`
+    blocks until enough tokens are available. `throttle` halves the rate after a
+    rate-limit error and `recover` creeps it back up towards `max_rate` on success.
+    """
+
+    def __init__(
+        self,
+        rate: float = USER_QUOTA_UNITS_PER_SECOND,
+        capacity: Optional[float] = None,
+        min_rate: float = 5.0,
+        increase: float = 1.0,
+    ):
+        self.rate = float(rate)
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.increase = float(increase)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float) -> float:
+        """Take `tokens` (at most `capacity`) if available; otherwise return the seconds to wait."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1):
+        # Requests costing more than the bucket holds (e.g. a 100-call batch) are
+        # paid for in capacity-sized instalments.
+        while tokens > 0:
+            step = min(tokens, self.capacity)
+            wait = self.try_acquire(step)
+            while wait > 0:
+                time.sleep(wait)
+                wait = self.try_acquire(step)
+            tokens -= step
+
+    async def acquire_async(self, tokens: float = 1):
+        while tokens > 0:
+            step = min(tokens, self.capacity)
+            wait = self.try_acquire(step)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.try_acquire(step)
+            tokens -= step
+
+    def throttle(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def recover(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class RetryStats:
+    """Counters for the retry layer: retries issued, rate-limit responses seen, calls given up on."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+
+    def record(self, retries: int = 0, throttled: int = 0, failures: int = 0):
+        with self._lock:
+            self.retries += retries
+            self.throttled += throttled
+            self.failures += failures
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {"retries": self.retries, "throttled": self.throttled, "failures": self.failures}
+
+    def reset(self):
+        with self._lock:
+            self.retries = self.throttled = self.failures = 0
+
+
+# Shared by every Gmail call in the process so they all pace against one quota.
+SHARED_BUCKET = TokenBucket()
+STATS = RetryStats()
+
+
+def error_reasons(payload: Any) -> Set[str]:
+    """Reasons in a Google API error body: error.errors[].reason plus error.details[].reason."""
+    err = payload.get("error") if isinstance(payload, dict) else None
+    if not isinstance(err, dict):
+        return set()
+    entries = (err.get("errors") or []) + (err.get("details") or [])
+    return {e["reason"] for e in entries if isinstance(e, dict) and e.get("reason")}
+
+
+def error_status(error: HttpError) -> Optional[int]:
+    """HTTP status of `error`, or None when it has no response (e.g. a BatchError)."""
+    return getattr(error.resp, "status", None)
+
+
+def _error_reasons(error: HttpError) -> Set[str]:
+    # HttpError.error_details holds only one of the two lists (details when present),
+    # so read both from the response body.
+    try:
+        return error_reasons(json.loads(error.content))
+    except (TypeError, ValueError):
+        return set()
+
+
+def status_is_rate_limited(status: Optional[int], reasons=frozenset()) -> bool:
+    return status == 429 or (status == 403 and bool(set(reasons) & RATE_LIMIT_REASONS))
+
+
+def status_is_retryable(status: Optional[int], reasons=frozenset()) -> bool:
+    return status in RETRYABLE_STATUSES or status_is_rate_limited(status, reasons)
+
+
+def is_rate_limited(error: HttpError) -> bool:
+    return status_is_rate_limited(error_status(error), _error_reasons(error))
+
+
+def is_retryable(error: HttpError) -> bool:
+    return status_is_retryable(error_status(error), _error_reasons(error))
+
+
+def parse_retry_after(value) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(error: HttpError) -> Optional[float]:
+    return parse_retry_after(error.resp.get("retry-after") if hasattr(error.resp, "get") else None)
+
+
+def backoff_delay(attempt: int, error: Optional[HttpError] = None) -> float:
+    """Retry-After when the server sent one, otherwise exponential backoff with full jitter."""
+    if error is not None:
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return retry_after
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt)))
+
+
+def execute_with_retry(
+    request,
+    cost: float = 1,
+    bucket: Optional[TokenBucket] = None,
+    max_retries: int = MAX_RETRIES,
+    stats: RetryStats = STATS,
+) -> Any:
+    """
+    Execute a googleapiclient request, retrying 429/5xx (and rate-limit 403s).
+
+    Each attempt first takes `cost` quota units from `bucket` (SHARED_BUCKET by
+    default). Rate-limit errors halve the bucket's rate; successes let it recover.
+    The final HttpError is re-raised once retries are exhausted.
+    """
+    bucket = bucket or SHARED_BUCKET
+    for attempt in range(max_retries + 1):
+        bucket.acquire(cost)
+        try:
+            result = request.execute()
+        except HttpError as error:
+            if not is_retryable(error) or attempt == max_retries:
+                stats.record(failures=1)
+                raise
+            throttled = is_rate_limited(error)
+            if throttled:
+                bucket.throttle()
+            stats.record(retries=1, throttled=int(throttled))
+            time.sleep(backoff_delay(attempt, error))
+            continue
+        bucket.recover()
+        return result
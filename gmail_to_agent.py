@@ -1,31 +1,155 @@
 # gmail_to_agent.py
-import json
+import asyncio
+import codec
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
 from gmail_client import (
-    gmail_authenticate,
-    list_message_ids,
+    gmail_service,
+    get_attachment,
+    get_credentials,
+    get_messages_concurrent,
+    iter_message_ids,
+    iter_threads,
+    get_thread,
+    get_profile,
+    list_history_message_ids,
+    HistoryExpiredError,
     get_message,
-    create_label_if_not_exists,
-    add_label_to_message,
+    get_messages_batch,
+    BATCH_SIZE,
+    LabelRegistry,
+    batch_modify_labels,
+    BATCH_MODIFY_SIZE,
 )
-from agent_logic import process_email, load_prompts
+from raw_store import RawStore
+from blob_store import BlobStore
+from body_cache import attach_body_view
+from data_io import atomic_write_json
+from email_store import get_email_store
+from agent_logic import process_email, load_prompts, summarize_email
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 
 DATA_DIR = Path("data")
+# Legacy whole-file dump; imported into the segmented RawStore on first use.
 RAW_PATH = DATA_DIR / "gmail_raw.json"
+RAW_STORE_DIR = DATA_DIR / "raw"
+# Message payloads referenced from the raw store, stored once per unique content.
+BLOB_DIR = DATA_DIR / "blobs"
+SYNC_STATE_PATH = DATA_DIR / "gmail_sync.json"
+BODY_CACHE_DIR = DATA_DIR / "bodies"
+THREAD_STATE_PATH = DATA_DIR / "thread_state.json"
+# Characters of thread text kept as the "summary" when no LLM is used.
+THREAD_DIGEST_CHARS = 1500
+
+PROCESSED_LABEL = "Processed"
+# Category labels are nested so they never clash with Gmail's system labels
+# (IMPORTANT, SPAM).
+CATEGORY_LABEL_PREFIX = "Agent/"
+
+CATEGORIES = ["Important", "Newsletter", "Spam", "To-Do"]
+# Gmail answers 404 (or 400 "Invalid label") when a cached label ID was deleted.
+STALE_LABEL_STATUSES = (400, 404)
+
+def category_label_name(category: str) -> str:
+    return f"{CATEGORY_LABEL_PREFIX}{category}"
+
+_store: Optional[RawStore] = None
+_store_lock = threading.Lock()
+
+def _raw_store() -> RawStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            store = RawStore(RAW_STORE_DIR, blobs=BlobStore(BLOB_DIR))
+            # One-time migration of the old whole-file raw dump.
+            if not len(store) and RAW_PATH.exists():
+                store.import_legacy_json(RAW_PATH)
+            _store = store
+        return _store
+
+def _service_or_pooled(service=None):
+    """`service` as-is when the caller passed one, else one checked out of the shared pool."""
+    return nullcontext(service) if service is not None else gmail_service()
 
 def _save_raw_messages(raw_msgs: List[Dict[str, Any]]):
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
     try:
-        if RAW_PATH.exists():
-            existing = json.loads(RAW_PATH.read_text(encoding="utf-8") or "[]")
-        else:
-            existing = []
-        existing.extend(raw_msgs)
-        RAW_PATH.write_text(json.dumps(existing, indent=2), encoding="utf-8")
-    except Exception:
-        pass
+        _raw_store().append(raw_msgs)
+    except Exception as e:
+        print("Failed to save raw messages:", e)
+
+def _without_raw(email: Dict[str, Any]) -> Dict[str, Any]:
+    # raw_gmail lives in the raw store; returned emails stay small on large fetches.
+    return {k: v for k, v in email.items() if k != "raw_gmail"}
+
+def _light(email: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    A fetch result as returned to the caller. The email store holds the full record,
+    and the body is dropped once its view is cached (body_cache reads it from there).
+    """
+    drop = ("raw_gmail", "body") if email.get("body_hash") else ("raw_gmail",)
+    return {k: v for k, v in email.items() if k not in drop}
+
+def _save_to_email_store(processed: List[Dict[str, Any]], prompts: Optional[Dict[str, Any]] = None):
+    """Upsert fetched emails and their results into the SQLite store (searchable, paginated)."""
+    if not processed:
+        return
+    try:
+        store = get_email_store()
+        version = store.save_prompt_version(prompts) if prompts is not None else None
+        store.upsert_processed(processed, prompt_version=version)
+    except Exception as e:
+        print("Failed to save emails to the email store:", e)
+
+def get_raw_message(msg_id: str) -> Optional[Dict[str, Any]]:
+    """Latest stored raw record for a message, read by offset without loading the rest."""
+    return _raw_store().get(msg_id)
+
+def _load_sync_state() -> Dict[str, Any]:
+    if SYNC_STATE_PATH.exists():
+        try:
+            return codec.loads(SYNC_STATE_PATH.read_bytes() or b"{}")
+        except Exception:
+            return {}
+    return {}
+
+def _save_sync_state(state: Dict[str, Any]):
+    atomic_write_json(SYNC_STATE_PATH, state)
+
+def _apply_labels(service, registry: LabelRegistry, pending: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    """Flush queued {label name: [message ids]}; re-resolve and retry once if a cached ID went stale."""
+    failures = []
+    for label_name, msg_ids in pending.items():
+        if not msg_ids:
+            continue
+        label_id = registry.resolve(label_name)
+        if label_id:
+            chunk_failures = batch_modify_labels(service, msg_ids, add_label_ids=[label_id])
+            stale = [f for f in chunk_failures if f["status"] in STALE_LABEL_STATUSES]
+            if stale:
+                registry.invalidate(label_id)
+                label_id = registry.resolve(label_name)
+                if label_id:
+                    retry_ids = [i for f in stale for i in f["ids"]]
+                    chunk_failures = [f for f in chunk_failures if f not in stale]
+                    chunk_failures += batch_modify_labels(service, retry_ids, add_label_ids=[label_id])
+            failures.extend(chunk_failures)
+        msg_ids.clear()
+    return failures
+
+def _load_thread_state() -> Dict[str, Any]:
+    if THREAD_STATE_PATH.exists():
+        try:
+            return codec.loads(THREAD_STATE_PATH.read_bytes() or b"{}")
+        except Exception:
+            return {}
+    return {}
+
+def _save_thread_state(state: Dict[str, Any]):
+    atomic_write_json(THREAD_STATE_PATH, state)
 
 def _simple_simulate_processing(email: Dict[str, Any]) -> Dict[str, Any]:
     body_text = ""
@@ -65,78 +189,472 @@ def _simple_simulate_processing(email: Dict[str, Any]) -> Dict[str, Any]:
         "action_items": actions
     }
 
+def _to_email_dict(msg: Dict[str, Any]) -> Dict[str, Any]:
+    return attach_body_view({
+        "id": msg.get("id"),
+        "threadId": msg.get("threadId"),
+        "sender": msg.get("sender"),
+        "subject": msg.get("subject"),
+        "body": {
+            "text": (msg.get("body") or {}).get("text") if isinstance(msg.get("body"), dict) else (msg.get("body") or ""),
+            "html": (msg.get("body") or {}).get("html") if isinstance(msg.get("body"), dict) else None
+        },
+        "timestamp": msg.get("timestamp"),
+        "attachments": msg.get("attachments", []),
+        "raw_gmail": msg.get("raw_gmail", {}),
+        **({"body_loaded": False} if msg.get("body_loaded") is False else {})
+    })
+
+# Fields of a full fetch that a metadata-only email is missing.
+FULL_MESSAGE_FIELDS = ("body", "attachments", "raw_gmail")
+
+def _read_cached_message(msg_id: str) -> Optional[Dict[str, Any]]:
+    path = BODY_CACHE_DIR / f"{msg_id}.json"
+    if path.exists():
+        try:
+            cached = codec.loads(path.read_bytes())
+        except Exception:
+            return None
+        # Older cache files hold the body alone; those are fetched again.
+        if isinstance(cached, dict) and all(k in cached for k in FULL_MESSAGE_FIELDS):
+            return cached
+    return None
+
+def _write_cached_message(msg_id: str, parts: Dict[str, Any]):
+    try:
+        atomic_write_json(BODY_CACHE_DIR / f"{msg_id}.json", parts)
+    except Exception:
+        pass
+
+def load_full_bodies(emails: List[Dict[str, Any]], service=None) -> List[Dict[str, Any]]:
+    """
+    Return `emails` with the full message for any that were fetched as metadata only.
+
+    Body, attachments and the full raw_gmail come from the local cache in data/bodies/
+    when possible; the rest are fetched in one batch request and cached. Loaded emails
+    are saved to the raw and email stores (the full record replaces the metadata stub).
+    Emails that could not be loaded are returned unchanged.
+    """
+    loaded: Dict[str, Dict[str, Any]] = {}
+    missing = []
+    for e in emails:
+        if e.get("body_loaded", True):
+            continue
+        cached = _read_cached_message(e["id"])
+        if cached is not None:
+            loaded[e["id"]] = cached
+        else:
+            missing.append(e["id"])
+
+    if missing:
+        with _service_or_pooled(service) as service:
+            for msg in get_messages_batch(service, missing):
+                full = _to_email_dict(msg)
+                parts = {k: full[k] for k in FULL_MESSAGE_FIELDS}
+                _write_cached_message(msg["id"], parts)
+                loaded[msg["id"]] = parts
+
+    result = []
+    for e in emails:
+        if e.get("id") in loaded:
+            e = {k: v for k, v in e.items() if k not in ("body_loaded", "body_hash")}
+            e = attach_body_view({**e, **loaded[e["id"]]})
+        result.append(e)
+    if loaded:
+        full_emails = [e for e in result if e.get("id") in loaded]
+        _save_raw_messages(full_emails)
+        _save_to_email_store(full_emails)
+    return result
+
+def load_full_body(email: Dict[str, Any], service=None) -> Dict[str, Any]:
+    """One email with its full message loaded; raw_gmail is left in the raw store."""
+    return _without_raw(load_full_bodies([email], service=service)[0])
+
+def load_attachment(email: Dict[str, Any], attachment: Dict[str, Any], service=None) -> bytes:
+    """Fetch (or read from the local cache) the bytes of one entry of email["attachments"]."""
+    if not attachment.get("attachmentId"):
+        return b""
+    with _service_or_pooled(service) as service:
+        return get_attachment(service, email["id"], attachment["attachmentId"])
+
+def _process_one(
+    email_dict: Dict[str, Any],
+    prompts: Dict[str, Any],
+    skip_processing: bool,
+    simulate_processing: bool,
+) -> Dict[str, Any]:
+    if skip_processing:
+        if simulate_processing:
+            return _simple_simulate_processing(email_dict)
+        return email_dict
+    try:
+        return process_email(email_dict, prompts)
+    except Exception as e:
+        return {
+            **email_dict,
+            "category": "Unknown",
+            "category_reason": f"Processing error: {str(e)}",
+            "action_items": []
+        }
+
 def fetch_and_process_gmail(
-    max_messages: int = 50,
+    max_messages: Optional[int] = 50,
     query: Optional[str] = None,
     mark_processed: bool = True,
     skip_processing: bool = False,
     simulate_processing: bool = False,
     sleep_between_calls: float = 0.05,
+    use_batch: bool = True,
+    incremental: bool = False,
+    label_categories: bool = False,
+    message_format: str = "full",
+    workers: int = 1,
 ) -> List[Dict[str, Any]]:
     """
     Fetch messages from Gmail and process them.
 
     Args:
-      max_messages: max messages to fetch
+      max_messages: max messages to fetch (None follows every result page)
       query: optional Gmail search query (e.g., "is:unread -label:Processed")
-      mark_processed: if True, add label "Processed" to messages
+      mark_processed: if True, add label "Processed" to messages (batched via batchModify)
       skip_processing: if True, DO NOT call process_email (skip LLM calls)
       simulate_processing: if True and skip_processing==True, run a small heuristic simulator
+      sleep_between_calls: pause after each message (or after each batch when use_batch is set)
+      use_batch: if True (and workers == 1), fetch up to BATCH_SIZE messages per batch HTTP request
+      incremental: if True, fetch every message added since the last saved historyId
+        (users.history.list); falls back to a full `query` listing on first run or when
+        the history ID has expired. max_messages does not apply in this mode, since
+        the checkpoint moves past everything that is listed
+      label_categories: if True, also add an "Agent/<category>" label per processed message
+      message_format: "full" downloads every body up front; "raw" downloads each message as
+        one RFC 822 blob, parses it locally and keeps that blob instead of the JSON part
+        tree; "metadata" fetches headers and snippet only, and bodies are loaded (and
+        cached) when processing needs them or via load_full_body when an email is opened
+      workers: if > 1, fetch concurrently on that many threads (services shared from the process-wide pool),
+        paced by a shared token bucket sized to Gmail's per-user quota instead of
+        sleep_between_calls
     Returns:
-      List of processed email dicts.
+      List of processed email dicts. Results are saved to the email store chunk by
+      chunk; the returned dicts omit raw_gmail, and "body" once its view is cached.
     """
-    service = gmail_authenticate()
-    ids = list_message_ids(service, query=query, max_results=max_messages)
-    prompts = load_prompts()
-    processed = []
-    raw_saved = []
-    label_id = create_label_if_not_exists(service, label_name="Processed")
-
-    for msg_id in ids:
-        msg = get_message(service, msg_id)
-        if not msg:
-            continue
+    with gmail_service() as service:
+        profile = get_profile(service)
+        account = profile.get("emailAddress", "me")
+        registry = LabelRegistry(service, account)
+        sync_state = None
+        if incremental:
+            sync_state = _load_sync_state()
+            start_history_id = (sync_state.get(account) or {}).get("historyId")
+            ids = None
+            if start_history_id:
+                try:
+                    # max_messages is not applied here: the checkpoint advances past
+                    # everything listed, so capping would silently skip new mail.
+                    history_ids, new_history_id = list_history_message_ids(service, start_history_id)
+                    ids = iter(history_ids)
+                except HistoryExpiredError:
+                    print("History ID expired; running a full resync.")
+            if ids is None:
+                # Take the checkpoint before listing so nothing added meanwhile is missed.
+                # Uncapped for the same reason as above: mail past max_messages would
+                # sit behind the new checkpoint and never be fetched.
+                new_history_id = profile.get("historyId")
+                ids = iter_message_ids(service, query=query)
+        else:
+            ids = iter_message_ids(service, query=query, max_results=max_messages)
+        prompts = load_prompts()
+        processed = []
+        wanted_labels = [PROCESSED_LABEL] if mark_processed else []
+        if label_categories:
+            wanted_labels += [category_label_name(c) for c in CATEGORIES]
+        registry.warm_up(wanted_labels)
+        pending_labels: Dict[str, List[str]] = {}
+        label_failures: List[Dict[str, Any]] = []
 
-        email_dict = {
-            "id": msg.get("id"),
-            "sender": msg.get("sender"),
-            "subject": msg.get("subject"),
-            "body": {
-                "text": (msg.get("body") or {}).get("text") if isinstance(msg.get("body"), dict) else (msg.get("body") or ""),
-                "html": (msg.get("body") or {}).get("html") if isinstance(msg.get("body"), dict) else None
-            },
-            "timestamp": msg.get("timestamp"),
-            "raw_gmail": msg.get("raw_gmail", {})
-        }
+        def _queue_label(label_name: str, msg_id: str):
+            ids_for_label = pending_labels.setdefault(label_name, [])
+            ids_for_label.append(msg_id)
+            if len(ids_for_label) >= BATCH_MODIFY_SIZE:
+                label_failures.extend(_apply_labels(service, registry, {label_name: ids_for_label}))
+
+        needs_body = not skip_processing or simulate_processing
 
-        raw_saved.append(email_dict)
+        def _handle_all(msgs: List[Dict[str, Any]]):
+            email_dicts = [_to_email_dict(msg) for msg in msgs]
+            if needs_body:
+                email_dicts = load_full_bodies(email_dicts, service=service)
+            # Saved per chunk, so memory stays flat and a crash keeps what was fetched
+            # and every result already paid for.
+            _save_raw_messages(email_dicts)
+            results = [_handle(_without_raw(email_dict)) for email_dict in email_dicts]
+            _save_to_email_store(results, None if skip_processing else prompts)
+            processed.extend(_light(r) for r in results)
 
-        if skip_processing:
-            if simulate_processing:
-                updated = _simple_simulate_processing(email_dict)
-            else:
-                updated = email_dict
+        def _handle(email_dict: Dict[str, Any]) -> Dict[str, Any]:
+            updated = _process_one(email_dict, prompts, skip_processing, simulate_processing)
+            if mark_processed:
+                _queue_label(PROCESSED_LABEL, email_dict["id"])
+            category = updated.get("category")
+            if label_categories and category and category != "Unknown":
+                _queue_label(category_label_name(category), email_dict["id"])
+            return updated
+
+        if workers > 1:
+            creds = get_credentials()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                while True:
+                    chunk = list(islice(ids, BATCH_SIZE))
+                    if not chunk:
+                        break
+                    _handle_all(get_messages_concurrent(creds, chunk, fmt=message_format, pool=pool))
+        elif use_batch:
+            while True:
+                chunk = list(islice(ids, BATCH_SIZE))
+                if not chunk:
+                    break
+                _handle_all(get_messages_batch(service, chunk, fmt=message_format))
+                if sleep_between_calls:
+                    time.sleep(sleep_between_calls)
         else:
-            try:
-                updated = process_email(email_dict, prompts)
-            except Exception as e:
-                updated = {
-                    **email_dict,
-                    "category": "Unknown",
-                    "category_reason": f"Processing error: {str(e)}",
-                    "action_items": []
-                }
+            for msg_id in ids:
+                msg = get_message(service, msg_id, fmt=message_format)
+                if not msg:
+                    continue
+                _handle_all([msg])
+                if sleep_between_calls:
+                    time.sleep(sleep_between_calls)
+
+        label_failures.extend(_apply_labels(service, registry, pending_labels))
+        if label_failures:
+            failed = sum(len(f["ids"]) for f in label_failures)
+            print(f"Labelling failed for {failed} messages in {len(label_failures)} chunk(s).")
 
-        processed.append(updated)
+        if sync_state is not None and new_history_id:
+            sync_state[account] = {"historyId": new_history_id}
+            _save_sync_state(sync_state)
+        return processed
 
-        if mark_processed and label_id:
-            try:
-                add_label_to_message(service, msg_id, label_id)
-            except Exception:
-                pass
+async def _resolve_labels_async(client, registry: LabelRegistry, label_names: List[str]) -> Dict[str, str]:
+    missing = registry.missing(label_names)
+    if missing:
+        resolved = {}
+        try:
+            existing = {lbl.get("name"): lbl["id"] for lbl in await client.list_labels()}
+            for name in missing:
+                resolved[name] = existing.get(name) or await client.create_label(name)
+        except Exception as e:
+            print("Error resolving labels:", e)
+        finally:
+            registry.remember(resolved)
+    # The registry has no sync service here, so only its cache is consulted.
+    return {name: registry.cached(name) for name in label_names}
 
-        if sleep_between_calls:
-            time.sleep(sleep_between_calls)
+async def _apply_labels_async(client, registry: LabelRegistry, pending: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    failures = []
+    for label_name, msg_ids in pending.items():
+        if not msg_ids:
+            continue
+        label_id = (await _resolve_labels_async(client, registry, [label_name]))[label_name]
+        if label_id:
+            chunk_failures = await client.batch_modify_labels(msg_ids, add_label_ids=[label_id])
+            stale = [f for f in chunk_failures if f["status"] in STALE_LABEL_STATUSES]
+            if stale:
+                registry.invalidate(label_id)
+                label_id = (await _resolve_labels_async(client, registry, [label_name]))[label_name]
+                if label_id:
+                    retry_ids = [i for f in stale for i in f["ids"]]
+                    chunk_failures = [f for f in chunk_failures if f not in stale]
+                    chunk_failures += await client.batch_modify_labels(retry_ids, add_label_ids=[label_id])
+            failures.extend(chunk_failures)
+        msg_ids.clear()
+    return failures
+
+async def fetch_and_process_gmail_async(
+    max_messages: Optional[int] = 50,
+    query: Optional[str] = None,
+    mark_processed: bool = True,
+    skip_processing: bool = False,
+    simulate_processing: bool = False,
+    label_categories: bool = False,
+    message_format: str = "full",
+    concurrency: int = 200,
+    client=None,
+) -> List[Dict[str, Any]]:
+    """
+    Async counterpart of fetch_and_process_gmail built on gmail_async.AsyncGmailClient.
+
+    Keeps up to `concurrency` message fetches in flight over one pooled HTTP session.
+    Processing runs in a worker thread so LLM calls do not block the event loop.
+    Pass an existing `client` (e.g. one pointed at a fake server) to reuse it; otherwise
+    one is created from the saved OAuth credentials. Incremental sync is not supported here.
+    """
+    from gmail_async import AsyncGmailClient
+
+    own_client = client is None
+    if own_client:
+        client = AsyncGmailClient(get_credentials())
+    try:
+        profile = await client.get_profile()
+        registry = LabelRegistry(None, profile.get("emailAddress", "me"))
+        wanted_labels = [PROCESSED_LABEL] if mark_processed else []
+        if label_categories:
+            wanted_labels += [category_label_name(c) for c in CATEGORIES]
+        await _resolve_labels_async(client, registry, wanted_labels)
+
+        prompts = load_prompts()
+        needs_body = not skip_processing or simulate_processing
+        processed: List[Dict[str, Any]] = []
+        pending_labels: Dict[str, List[str]] = {}
+
+        async def _handle_chunk(chunk: List[str]):
+            msgs = await client.get_messages(chunk, fmt=message_format, concurrency=concurrency)
+            if needs_body and message_format != "full":
+                full = {m["id"]: m for m in await client.get_messages(
+                    [m["id"] for m in msgs if m.get("body_loaded") is False], concurrency=concurrency)}
+                msgs = [full.get(m["id"], m) for m in msgs]
+            email_dicts = [_to_email_dict(msg) for msg in msgs]
+            await asyncio.to_thread(_save_raw_messages, email_dicts)
+            email_dicts = [_without_raw(e) for e in email_dicts]
+            results = await asyncio.to_thread(
+                lambda: [_process_one(e, prompts, skip_processing, simulate_processing) for e in email_dicts]
+            )
+            await asyncio.to_thread(_save_to_email_store, results, None if skip_processing else prompts)
+            processed.extend(_light(r) for r in results)
+            for updated in results:
+                if mark_processed:
+                    pending_labels.setdefault(PROCESSED_LABEL, []).append(updated["id"])
+                category = updated.get("category")
+                if label_categories and category and category != "Unknown":
+                    pending_labels.setdefault(category_label_name(category), []).append(updated["id"])
+
+        chunk: List[str] = []
+        async for msg_id in client.iter_message_ids(query=query, max_results=max_messages):
+            chunk.append(msg_id)
+            if len(chunk) >= concurrency:
+                await _handle_chunk(chunk)
+                chunk = []
+        if chunk:
+            await _handle_chunk(chunk)
+
+        label_failures = await _apply_labels_async(client, registry, pending_labels)
+        if label_failures:
+            failed = sum(len(f["ids"]) for f in label_failures)
+            print(f"Labelling failed for {failed} messages in {len(label_failures)} chunk(s).")
+    finally:
+        if own_client:
+            await client.aclose()
 
-    _save_raw_messages(raw_saved)
     return processed
+
+
+def _thread_email(thread_id: str, new_emails: List[Dict[str, Any]], summary: str) -> Dict[str, Any]:
+    """One synthetic email holding the earlier-thread summary plus every new message."""
+    sections = []
+    if summary:
+        sections.append(f"Earlier in this thread (summary):\n{summary}")
+    for e in new_emails:
+        sections.append(f"From: {e.get('sender')}\nDate: {e.get('timestamp')}\nSubject: {e.get('subject')}\n\n{(e.get('body') or {}).get('text') or ''}")
+    last = new_emails[-1]
+    return {
+        "id": thread_id,
+        "threadId": thread_id,
+        "sender": last.get("sender"),
+        "subject": last.get("subject"),
+        "timestamp": last.get("timestamp"),
+        "body": {"text": "\n\n---\n\n".join(sections), "html": None},
+    }
+
+def _thread_summary(thread_email: Dict[str, Any], use_llm: bool) -> str:
+    text = thread_email["body"]["text"]
+    if use_llm:
+        try:
+            return summarize_email(thread_email)
+        except Exception:
+            pass
+    return text[-THREAD_DIGEST_CHARS:]
+
+def fetch_and_process_threads(
+    max_threads: Optional[int] = 20,
+    query: Optional[str] = None,
+    mark_processed: bool = True,
+    skip_processing: bool = False,
+    simulate_processing: bool = False,
+    label_categories: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Thread-aware variant of fetch_and_process_gmail.
+
+    Lists threads with users.threads.list and skips any whose historyId matches the one
+    saved in data/thread_state.json. Changed threads are fetched with users.threads.get.
+    Processing runs once per thread, over the messages not seen before plus a cached
+    summary of the earlier ones. The category/action items are then copied onto each
+    new message.
+
+    Returns:
+      List of processed email dicts (new messages only), light as in fetch_and_process_gmail.
+    """
+    with gmail_service() as service:
+        profile = get_profile(service)
+        registry = LabelRegistry(service, profile.get("emailAddress", "me"))
+        wanted_labels = [PROCESSED_LABEL] if mark_processed else []
+        if label_categories:
+            wanted_labels += [category_label_name(c) for c in CATEGORIES]
+        registry.warm_up(wanted_labels)
+
+        prompts = load_prompts()
+        state = _load_thread_state()
+        processed: List[Dict[str, Any]] = []
+        pending_labels: Dict[str, List[str]] = {}
+
+        for listed in iter_threads(service, query=query, max_results=max_threads):
+            thread_id = listed["id"]
+            known = state.get(thread_id) or {}
+            if known.get("historyId") and known.get("historyId") == listed.get("historyId"):
+                continue
+
+            thread = get_thread(service, thread_id)
+            if not thread:
+                continue
+            seen_ids = set(known.get("message_ids", []))
+            new_emails = [_to_email_dict(m) for m in thread["messages"] if m.get("id") not in seen_ids]
+
+            if new_emails:
+                _save_raw_messages(new_emails)
+                new_emails = [_without_raw(e) for e in new_emails]
+                combined = _thread_email(thread_id, new_emails, known.get("summary", ""))
+                result = _process_one(combined, prompts, skip_processing, simulate_processing)
+                fanned = [
+                    {
+                        **e,
+                        **{k: result[k] for k in ("category", "category_reason", "action_items") if k in result},
+                    }
+                    for e in new_emails
+                ]
+                _save_to_email_store(fanned, None if skip_processing else prompts)
+                processed.extend(_light(e) for e in fanned)
+
+                for e in fanned:
+                    if mark_processed:
+                        pending_labels.setdefault(PROCESSED_LABEL, []).append(e["id"])
+                    category = e.get("category")
+                    if label_categories and category and category != "Unknown":
+                        pending_labels.setdefault(category_label_name(category), []).append(e["id"])
+
+                known = {
+                    "summary": _thread_summary(combined, use_llm=not skip_processing),
+                    "result": {k: result.get(k) for k in ("category", "category_reason", "action_items")},
+                }
+
+            state[thread_id] = {
+                **known,
+                "historyId": thread.get("historyId") or listed.get("historyId"),
+                "message_ids": [m.get("id") for m in thread["messages"]],
+            }
+
+        label_failures = _apply_labels(service, registry, pending_labels)
+        if label_failures:
+            failed = sum(len(f["ids"]) for f in label_failures)
+            print(f"Labelling failed for {failed} messages in {len(label_failures)} chunk(s).")
+
+        _save_thread_state(state)
+        return processed
@@ -0,0 +1,140 @@
+# html_text.py
+#
+# HTML -> readable text for message bodies. Output matches what the app used to get
+# from BeautifulSoup(html, "html.parser") with <script>/<style> removed, then
+# get_text(separator="\n") with every line stripped and blank lines dropped.
+# Backends: selectolax or lxml when installed, else a streaming html.parser pass
+# that never builds a tree.
+import html
+import os
+from html.entities import html5
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    try:
+        # selectolax < 1.0 without lexbor; 1.0 dropped the Modest parser.
+        from selectolax.parser import HTMLParser as SelectolaxParser
+    except ImportError:
+        SelectolaxParser = None
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+# Elements whose content is never text.
+SKIPPED_TAGS = ("script", "style")
+
+# Named references, looked up the way BeautifulSoup does: "&curren" inside
+# "&currency=EUR" stays literal, where html.unescape would turn it into "¤".
+_ENTITIES = {name[:-1]: char for name, char in html5.items() if name.endswith(";")}
+
+
+def _tidy_lines(text: str) -> str:
+    lines = [line.strip() for line in text.splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+class _TextCollector(HTMLParser):
+    """Collects text nodes, one string per node, outside <script>/<style>."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.nodes: List[str] = []
+        self._pending: List[str] = []
+        self._skip_depth = 0
+
+    def _flush(self):
+        # html.parser may hand one text node over in several handle_data calls;
+        # joining them here keeps node boundaries the same as in a parsed tree.
+        if self._pending:
+            self.nodes.append("".join(self._pending))
+            self._pending = []
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush()
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._pending.append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(_ENTITIES.get(name, f"&{name}"))
+
+    def handle_charref(self, name):
+        self.handle_data(html.unescape(f"&#{name};"))
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        # <![CDATA[...]]> counts as text; other marked sections do not.
+        if data.startswith("CDATA[") and not self._skip_depth:
+            self.nodes.append(data[len("CDATA["):])
+
+
+def _stream_to_text(html: str) -> str:
+    collector = _TextCollector()
+    collector.feed(html)
+    collector.close()
+    collector._flush()
+    return _tidy_lines("\n".join(collector.nodes))
+
+
+def _selectolax_to_text(html: str) -> str:
+    tree = SelectolaxParser(html)
+    tree.strip_tags(list(SKIPPED_TAGS))
+    if tree.root is None:
+        return ""
+    return _tidy_lines(tree.root.text(deep=True, separator="\n", strip=False))
+
+
+def _lxml_to_text(html: str) -> str:
+    try:
+        root = lxml.html.document_fromstring(html)
+    except (etree.ParserError, ValueError):
+        # Empty documents, or str input carrying an XML encoding declaration.
+        return _stream_to_text(html)
+    etree.strip_elements(root, *SKIPPED_TAGS, with_tail=False)
+    etree.strip_tags(root, etree.Comment, etree.ProcessingInstruction)
+    return _tidy_lines("\n".join(root.itertext()))
+
+
+BACKENDS: Dict[str, Callable[[str], str]] = {}
+if SelectolaxParser is not None:
+    BACKENDS["selectolax"] = _selectolax_to_text
+if lxml is not None:
+    BACKENDS["lxml"] = _lxml_to_text
+BACKENDS["stream"] = _stream_to_text
+
+# EMAIL_AGENT_HTML_BACKEND=stream forces a backend (e.g. to compare or debug).
+BACKEND = os.getenv("EMAIL_AGENT_HTML_BACKEND") or next(iter(BACKENDS))
+if BACKEND not in BACKENDS:
+    raise ValueError(f"HTML backend {BACKEND!r} is not available (installed: {', '.join(BACKENDS)})")
+
+
+def html_to_text(html: str, backend: Optional[str] = None) -> str:
+    if not html:
+        return ""
+    return BACKENDS[backend or BACKEND](html)
@@ -0,0 +1,477 @@
+# raw_store.py
+import argparse
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import codec
+from blob_store import BLOB_DIR, BlobStore, blob_refs, externalize, rehydrate
+from data_io import atomic_write_bytes, file_lock, fsync_dir
+
+RAW_STORE_DIR = Path("data") / "raw"
+LEGACY_RAW_PATH = Path("data") / "gmail_raw.json"
+
+# A new segment is started once the current one would grow past this size.
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+SEGMENT_PATTERN = "segment-{:06d}.jsonl"
+INDEX_NAME = "index-v2.bin"
+# Indexes written by earlier versions (text, then entries without the loaded flag);
+# the index is rebuilt from the segments and these are removed.
+LEGACY_INDEX_NAMES = ("index.jsonl", "index.bin")
+
+# One fixed-size index entry: 8-byte blake2b key of the message ID, segment,
+# offset, length, historyId (-1 when unknown) and whether the record has its body
+# (1) or is a metadata-only stub (0). Later entries for a key win.
+INDEX_ENTRY = struct.Struct("<8sIQIqB")
+
+# (historyId, body loaded) of a stored record; see _is_newer.
+Version = Tuple[Optional[int], bool]
+
+
+def history_id(record: Dict[str, Any]) -> Optional[int]:
+    """Gmail historyId of a raw record (top level or inside raw_gmail), as an int."""
+    value = record.get("historyId")
+    if value is None and isinstance(record.get("raw_gmail"), dict):
+        value = record["raw_gmail"].get("historyId")
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def record_version(record: Dict[str, Any]) -> Version:
+    return history_id(record), record.get("body_loaded") is not False
+
+
+def _is_newer(new: Version, old: Version) -> bool:
+    new_hist, new_loaded = new
+    old_hist, old_loaded = old
+    # Records without a historyId cannot be ordered, so the latest write wins.
+    if new_hist is None or old_hist is None:
+        return True
+    if new_hist != old_hist:
+        return new_hist > old_hist
+    # Same historyId: a full fetch replaces the metadata-only stub of that message.
+    return new_loaded and not old_loaded
+
+
+def _unpack_index(data: bytes) -> Iterator[Tuple[bytes, Tuple[int, int, int, Version]]]:
+    for key, seg, off, length, hist, loaded in INDEX_ENTRY.iter_unpack(data):
+        yield key, (seg, off, length, (None if hist < 0 else hist, bool(loaded)))
+
+
+def message_key(msg_id) -> bytes:
+    return hashlib.blake2b(str(msg_id).encode("utf-8"), digest_size=8).digest()
+
+
+def _truncate_torn_tail(path: Path) -> int:
+    """Drop a partially written last line (crash mid-append); returns the clean size."""
+    size = path.stat().st_size
+    if size == 0:
+        return 0
+    with open(path, "rb+") as f:
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return size
+        block = 64 * 1024
+        end = size
+        while end > 0:
+            start = max(0, end - block)
+            f.seek(start)
+            chunk = f.read(end - start)
+            nl = chunk.rfind(b"\n")
+            if nl != -1:
+                clean = start + nl + 1
+                break
+            end = start
+        else:
+            clean = 0
+        f.truncate(clean)
+        f.flush()
+        os.fsync(f.fileno())
+    return clean
+
+
+class RawStore:
+    """
+    Append-only store for raw fetched messages.
+
+    Records are JSON lines in size-rotated segment files; the index file holds fixed-size
+    entries mapping an 8-byte hash of each message ID to (segment, offset, length,
+    historyId, body loaded) of its latest record. Appending a batch writes only that
+    batch (plus its index entries) and fsyncs; existing bytes are never rewritten, so a crash can at
+    worst leave a torn last line or entry, which is dropped on open.
+
+    get() slices the record out of a memory-mapped segment, so reading one message
+    costs the same whatever the store size; the record's own "id" is checked against
+    the requested one to rule out a hash collision.
+
+    Writes are upserts by message ID: a record is only appended when its historyId is
+    newer than the stored one, or equal to it when the stored record is a metadata-only
+    stub (body_loaded False) and the new one is not. Superseded records stay in the segments until compact().
+
+    Several processes may share one store: opening, append() and compact() hold
+    data_io.file_lock(root), and append() first reads any index entries other
+    processes wrote since, so its upsert decisions and offsets are current.
+
+    With `blobs`, payload strings (bodies, base64 part data) are moved into the
+    content-addressed BlobStore and segment lines only hold references; get() resolves
+    them again, so callers always see the original record.
+    """
+
+    def __init__(
+        self,
+        root: Path = RAW_STORE_DIR,
+        segment_max_bytes: int = SEGMENT_MAX_BYTES,
+        blobs: Optional[BlobStore] = None,
+    ):
+        self.root = Path(root)
+        self.segment_max_bytes = segment_max_bytes
+        self.blobs = blobs
+        self._lock = threading.Lock()
+        self._index: Dict[bytes, Tuple[int, int, int, Optional[int]]] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._map_lock = threading.Lock()
+        # How much of the index file (which file, how many bytes) is reflected in _index.
+        self._index_ino = None
+        self._index_bytes = 0
+        with file_lock(self.root):
+            self._recover_compaction()
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._segment = self._latest_segment()
+            self._load_index()
+
+    # -- layout -------------------------------------------------------------
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.root / SEGMENT_PATTERN.format(segment)
+
+    def _segment_numbers(self) -> List[int]:
+        return sorted(int(p.stem.split("-")[1]) for p in self.root.glob("segment-*.jsonl"))
+
+    def _latest_segment(self) -> int:
+        numbers = self._segment_numbers()
+        return numbers[-1] if numbers else 1
+
+    @property
+    def _index_path(self) -> Path:
+        return self.root / INDEX_NAME
+
+    @property
+    def _compact_dir(self) -> Path:
+        return self.root.with_name(self.root.name + ".compact")
+
+    @property
+    def _retired_dir(self) -> Path:
+        return self.root.with_name(self.root.name + ".old")
+
+    def _recover_compaction(self):
+        # A crash between compact()'s two renames leaves the finished copy in
+        # <root>.compact and the original in <root>.old; finish the swap.
+        if not self.root.exists() and self._compact_dir.exists() and self._retired_dir.exists():
+            os.replace(self._compact_dir, self.root)
+        if self.root.exists():
+            shutil.rmtree(self._compact_dir, ignore_errors=True)
+            shutil.rmtree(self._retired_dir, ignore_errors=True)
+
+    # -- index --------------------------------------------------------------
+
+    def _load_index(self):
+        indexed_end: Dict[int, int] = {}
+        if self._index_path.exists():
+            size = self._index_path.stat().st_size
+            whole = size - size % INDEX_ENTRY.size
+            if whole != size:
+                os.truncate(self._index_path, whole)
+            data = self._index_path.read_bytes()
+            for key, entry in _unpack_index(data):
+                self._index[key] = entry
+                seg, off, length, _ = entry
+                indexed_end[seg] = max(indexed_end.get(seg, 0), off + length)
+            self._index_bytes = len(data)
+
+        # Records whose data reached disk but whose index line did not are re-indexed.
+        missing = []
+        for seg in self._segment_numbers():
+            path = self._segment_path(seg)
+            size = _truncate_torn_tail(path)
+            start = indexed_end.get(seg, 0)
+            if start < size:
+                missing.extend(self._scan_segment(seg, start))
+        if missing:
+            self._append_index(missing)
+        self._index_ino = self._index_path.stat().st_ino if self._index_path.exists() else None
+        for name in LEGACY_INDEX_NAMES:
+            legacy_index = self.root / name
+            if legacy_index.exists():
+                legacy_index.unlink()
+
+    def _scan_segment(self, seg: int, start: int = 0) -> List[Tuple[str, int, int, int, Version]]:
+        entries = []
+        with open(self._segment_path(seg), "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                try:
+                    record = codec.loads(line)
+                    msg_id = str(record["id"])
+                except codec.DECODE_ERRORS + (KeyError, TypeError):
+                    msg_id = None
+                if msg_id is not None:
+                    entry = (seg, offset, len(line), record_version(record))
+                    entries.append((msg_id, *entry))
+                    self._index[message_key(msg_id)] = entry
+                offset += len(line)
+        return entries
+
+    def _append_index(self, entries: List[Tuple[str, int, int, int, Version]]):
+        data = b"".join(
+            INDEX_ENTRY.pack(message_key(msg_id), seg, off, length, -1 if hist is None else hist, loaded)
+            for msg_id, seg, off, length, (hist, loaded) in entries
+        )
+        with open(self._index_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._index_bytes += len(data)
+
+    def _refresh_index(self):
+        """Catch up with index entries written by other processes; the caller holds the file lock."""
+        try:
+            st = self._index_path.stat()
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._index_ino or st.st_size < self._index_bytes:
+            # Replaced by another process's compact(): offsets changed, start over.
+            self.close()
+            self._index = {}
+            self._index_bytes = 0
+            self._segment = self._latest_segment()
+            self._load_index()
+            return
+        if st.st_size > self._index_bytes:
+            with open(self._index_path, "rb") as f:
+                f.seek(self._index_bytes)
+                data = f.read(st.st_size - self._index_bytes)
+            data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+            self._index.update(_unpack_index(data))
+            self._index_bytes += len(data)
+        self._segment = max(self._segment, self._latest_segment())
+
+    # -- public API ---------------------------------------------------------
+
+    def append(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Upsert a batch of message dicts (each with an "id"); returns how many were written.
+
+        Records whose historyId is not newer than the stored version (including exact
+        re-fetches) are skipped, as are older duplicates within the batch; a full record
+        still replaces a metadata-only stub with the same historyId.
+        """
+        if not records:
+            return 0
+        # The file lock spans the upsert check, the segment size read and the index
+        # append, so concurrent writers never hand out the same offsets.
+        with self._lock, file_lock(self.root):
+            self._refresh_index()
+            latest: Dict[str, Tuple[Dict[str, Any], Version]] = {}
+            for record in records:
+                msg_id = str(record["id"])
+                version = record_version(record)
+                current = latest.get(msg_id)
+                stored = self._index.get(message_key(msg_id))
+                if current is not None:
+                    if _is_newer(version, current[1]):
+                        latest[msg_id] = (record, version)
+                elif stored is None or _is_newer(version, stored[3]):
+                    latest[msg_id] = (record, version)
+            if not latest:
+                return 0
+
+            entries = []
+            path = self._segment_path(self._segment)
+            size = path.stat().st_size if path.exists() else 0
+            f = open(path, "ab")
+            try:
+                for msg_id, (record, version) in latest.items():
+                    if self.blobs is not None:
+                        record = externalize(record, self.blobs)
+                    line = codec.dumps(record) + b"\n"
+                    if size and size + len(line) > self.segment_max_bytes:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        f.close()
+                        self._segment += 1
+                        path = self._segment_path(self._segment)
+                        f = open(path, "ab")
+                        size = 0
+                        fsync_dir(self.root)
+                    f.write(line)
+                    entries.append((msg_id, self._segment, size, len(line), version))
+                    size += len(line)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            self._append_index(entries)
+            for msg_id, *entry in entries:
+                self._index[message_key(msg_id)] = tuple(entry)
+            return len(entries)
+
+    def _read(self, seg: int, off: int, length: int) -> bytes:
+        m = self._maps.get(seg)
+        if m is None or off + length > len(m):
+            # Map (or re-map, once the segment has grown) the whole segment file.
+            with self._map_lock:
+                m = self._maps.get(seg)
+                if m is None or off + length > len(m):
+                    with open(self._segment_path(seg), "rb") as f:
+                        fresh = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    if m is not None:
+                        m.close()
+                    self._maps[seg] = m = fresh
+        return m[off:off + length]
+
+    def _decode(self, data: bytes) -> Dict[str, Any]:
+        record = codec.loads(data)
+        return rehydrate(record, self.blobs) if self.blobs is not None else record
+
+    def get(self, msg_id: str) -> Optional[Dict[str, Any]]:
+        location = self._index.get(message_key(msg_id))
+        if location is None:
+            return None
+        seg, off, length, _ = location
+        record = self._decode(self._read(seg, off, length))
+        if str(record.get("id")) != str(msg_id):
+            return None
+        return record
+
+    def __contains__(self, msg_id) -> bool:
+        return message_key(msg_id) in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Yield every stored record (latest version per ID) in on-disk order."""
+        for seg, off, length, _ in sorted(self._index.values()):
+            yield self._decode(self._read(seg, off, length))
+
+    def close(self):
+        with self._map_lock:
+            for m in self._maps.values():
+                m.close()
+            self._maps = {}
+
+    def import_legacy_json(self, path: Path = LEGACY_RAW_PATH, batch_size: int = 500) -> int:
+        """Copy records from the old whole-file gmail_raw.json into the store."""
+        if not Path(path).exists():
+            return 0
+        records = codec.loads(Path(path).read_bytes() or b"[]")
+        written = 0
+        for start in range(0, len(records), batch_size):
+            written += self.append(records[start:start + batch_size])
+        return written
+
+    def dead_bytes(self) -> int:
+        """Segment bytes held by superseded records (compact() also drops blobs only they referenced)."""
+        live = sum(length for _, _, length, _ in self._index.values())
+        total = sum(self._segment_path(seg).stat().st_size for seg in self._segment_numbers())
+        return total - live
+
+    def compact(self) -> Tuple[int, int]:
+        """
+        Rewrite the store with only the latest record per ID; returns (bytes before, bytes after).
+
+        The live records are copied into a sibling <root>.compact directory, which then
+        replaces <root> by rename, so readers never see a half-compacted store. Blobs
+        no live record references are then deleted (mark and sweep); the byte counts
+        cover segments and blobs. The blob directory must not be shared with another store.
+        """
+        with self._lock, file_lock(self.root):
+            self._refresh_index()
+            before = self._disk_usage()
+            shutil.rmtree(self._compact_dir, ignore_errors=True)
+            fresh = RawStore(self._compact_dir, self.segment_max_bytes, blobs=self.blobs)
+            batch: List[Dict[str, Any]] = []
+            for seg, off, length, _ in sorted(self._index.values()):
+                batch.append(self._decode(self._read(seg, off, length)))
+                if len(batch) >= 500:
+                    fresh.append(batch)
+                    batch = []
+            fresh.append(batch)
+            fsync_dir(self._compact_dir)
+            # Marked from the rewritten records, which are what will reference blobs.
+            live: Set[str] = set()
+            if self.blobs is not None:
+                for seg, off, length, _ in fresh._index.values():
+                    live |= blob_refs(codec.loads(fresh._read(seg, off, length)))
+            fresh.close()
+            self.close()
+
+            os.replace(self.root, self._retired_dir)
+            os.replace(self._compact_dir, self.root)
+            fsync_dir(self.root.parent)
+            shutil.rmtree(self._retired_dir, ignore_errors=True)
+
+            self._index = {}
+            self._index_bytes = 0
+            self._segment = self._latest_segment()
+            self._load_index()
+            if self.blobs is not None:
+                self.blobs.sweep(live)
+            return before, self._disk_usage()
+
+    def _disk_usage(self) -> int:
+        size = sum(self._segment_path(seg).stat().st_size for seg in self._segment_numbers())
+        return size + (self.blobs.disk_usage() if self.blobs is not None else 0)
+
+
+def compact_legacy_json(path: Path = LEGACY_RAW_PATH) -> Tuple[int, int]:
+    """
+    De-duplicate a whole-file gmail_raw.json in place, keeping the latest historyId per ID
+    (first-seen order is preserved). Written via temp file + fsync + rename, so a crash
+    leaves either the old or the new file. Returns (records before, records after).
+    """
+    path = Path(path)
+    records = codec.loads(path.read_bytes() or b"[]")
+    latest: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        msg_id = str(record.get("id"))
+        current = latest.get(msg_id)
+        if current is None or _is_newer(record_version(record), record_version(current)):
+            latest[msg_id] = record
+    if len(latest) < len(records):
+        atomic_write_bytes(path, codec.dumps(list(latest.values())))
+    return len(records), len(latest)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Maintenance for the raw Gmail message store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compact_cmd = sub.add_parser("compact", help="drop superseded records from the segmented store")
+    compact_cmd.add_argument("--root", type=Path, default=RAW_STORE_DIR)
+    compact_cmd.add_argument("--blobs", type=Path, default=BLOB_DIR)
+    legacy_cmd = sub.add_parser("compact-legacy", help="de-duplicate the legacy gmail_raw.json by message ID")
+    legacy_cmd.add_argument("path", type=Path, nargs="?", default=LEGACY_RAW_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        before, after = RawStore(args.root, blobs=BlobStore(args.blobs)).compact()
+        print(f"Compacted {args.root}: {before} -> {after} bytes")
+    else:
+        if not args.path.exists():
+            print(f"{args.path} not found")
+            return
+        before, after = compact_legacy_json(args.path)
+        print(f"{args.path}: {before} records -> {after} unique messages")
+
+
+if __name__ == "__main__":
+    main()